@@ -0,0 +1 @@
+"""Offline benchmarks: run the syncers against a local fake API server."""
@@ -0,0 +1,394 @@
+"""Local stand-in for the Gmail, Drive, Calendar, Chat, Slack and Notion APIs.
+
+Everything is generated on the fly from the request (item ``i`` of a dataset is
+always the same), so even very large datasets cost no memory up front.
+"""
+
+import base64
+import json
+import math
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+FILLER = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. "
+
+DRIVE_MIME_TYPES = [
+    "application/vnd.google-apps.document",
+    "application/vnd.google-apps.presentation",
+    "application/vnd.google-apps.spreadsheet",
+    "application/pdf",
+]
+
+
+@dataclass
+class Dataset:
+    emails: int = 1000
+    email_bytes: int = 2000
+    drive_files: int = 200
+    drive_bytes: int = 5000
+    events: int = 500
+    spaces: int = 10
+    space_messages: int = 200
+    channels: int = 50
+    channel_messages: int = 200
+    notion_pages: int = 500
+
+
+def filler(size: int) -> str:
+    return (FILLER * (size // len(FILLER) + 1))[:size]
+
+
+def page(offset_token: Optional[str], size: int, total: int) -> Tuple[range, str]:
+    start = int(offset_token or 0)
+    end = min(start + size, total)
+    return range(start, end), (str(end) if end < total else "")
+
+
+class FakeAPI:
+    def __init__(
+        self,
+        dataset: Dataset,
+        latency_ms: float = 0.0,
+        throttle_every: int = 0,
+    ):
+        self.dataset = dataset
+        self.latency = latency_ms / 1000.0
+        self.throttle_every = throttle_every
+        # Every timestamp is derived from one anchor fixed at startup (UTC
+        # midnight, so reruns on the same day see the same data).
+        self.anchor = datetime.now(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        self.calls: Dict[str, int] = {}
+        self.throttled: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.routes: List[Tuple[str, str, Callable]] = [
+            ("gmail", "/gmail/v1/users/", self.gmail),
+            ("drive", "/drive/v3/files", self.drive),
+            ("calendar", "/calendar/v3/calendars/", self.calendar),
+            ("chat", "/v1/spaces", self.chat),
+            ("slack", "/api/", self.slack),
+            ("notion", "/v1/search", self.notion),
+        ]
+
+    # -- server lifecycle -------------------------------------------------
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeAPI":
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                api.handle(self)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {"calls": dict(self.calls), "throttled": dict(self.throttled)}
+
+    # -- dispatch ---------------------------------------------------------
+
+    def handle(self, req: BaseHTTPRequestHandler) -> None:
+        url = urlparse(req.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(req.headers.get("Content-Length") or 0)
+        body = req.rfile.read(length) if length else b""
+        if body:
+            ctype = req.headers.get("Content-Type", "")
+            if "json" in ctype:
+                params.update(json.loads(body))
+            else:
+                params.update({k: v[-1] for k, v in parse_qs(body.decode()).items()})
+
+        for service, prefix, handler in self.routes:
+            if url.path.startswith(prefix):
+                break
+        else:
+            return self.reply(req, 404, {"error": "not found"})
+
+        with self._lock:
+            count = self.calls.get(service, 0) + 1
+            self.calls[service] = count
+            throttle = self.throttle_every and count % self.throttle_every == 0
+            if throttle:
+                self.throttled[service] = self.throttled.get(service, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            return self.reply(
+                req,
+                429,
+                self.rate_limited(service),
+                headers={"Retry-After": "1"},
+            )
+
+        status, payload, ctype = handler(unquote(url.path[len(prefix):]), params)
+        self.reply(req, status, payload, ctype)
+
+    def reply(
+        self,
+        req: BaseHTTPRequestHandler,
+        status: int,
+        payload,
+        ctype: str = "application/json",
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        req.send_response(status)
+        req.send_header("Content-Type", ctype)
+        req.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            req.send_header(k, v)
+        req.end_headers()
+        req.wfile.write(data)
+
+    def rate_limited(self, service: str) -> Dict:
+        if service == "slack":
+            return {"ok": False, "error": "ratelimited"}
+        if service == "notion":
+            return {
+                "object": "error",
+                "status": 429,
+                "code": "rate_limited",
+                "message": "Rate limited",
+            }
+        return {"error": {"code": 429, "message": "Rate Limit Exceeded"}}
+
+    # -- Gmail ------------------------------------------------------------
+
+    def gmail(self, path: str, params: Dict):
+        # path: "<userId>/messages" or "<userId>/messages/<id>"
+        parts = path.split("/")
+        if len(parts) == 2:
+            size = int(params.get("maxResults", 100))
+            rng, token = page(params.get("pageToken"), size, self.dataset.emails)
+            resp = {"messages": [{"id": f"{i:016x}"} for i in rng]}
+            if token:
+                resp["nextPageToken"] = token
+            return 200, resp, "application/json"
+
+        mid = parts[2]
+        i = int(mid, 16)
+        sent = EPOCH + timedelta(minutes=i)
+        headers = [
+            {"name": "From", "value": f"sender{i % 97}@example.com"},
+            {"name": "To", "value": "me@example.com"},
+            {"name": "Subject", "value": f"Benchmark message {i}"},
+            {"name": "Date", "value": sent.strftime("%a, %d %b %Y %H:%M:%S +0000")},
+        ]
+        if params.get("format") == "raw":
+            head = "".join(f"{h['name']}: {h['value']}\r\n" for h in headers)
+            raw = (head + "\r\n" + filler(self.dataset.email_bytes)).encode()
+            resp = {"id": mid, "raw": base64.urlsafe_b64encode(raw).decode()}
+            return 200, resp, "application/json"
+        return (
+            200,
+            {
+                "id": mid,
+                "threadId": mid,
+                "snippet": filler(120),
+                "internalDate": str(int(sent.timestamp() * 1000)),
+                "payload": {"headers": headers},
+            },
+            "application/json",
+        )
+
+    # -- Drive ------------------------------------------------------------
+
+    def drive(self, path: str, params: Dict):
+        if path in ("", "/"):
+            size = int(params.get("pageSize", 100))
+            rng, token = page(params.get("pageToken"), size, self.dataset.drive_files)
+            files = [
+                {
+                    "id": f"file{i}",
+                    "name": f"Benchmark file {i}",
+                    "mimeType": DRIVE_MIME_TYPES[i % len(DRIVE_MIME_TYPES)],
+                    "modifiedTime": (EPOCH + timedelta(hours=i)).isoformat(),
+                }
+                for i in rng
+            ]
+            resp = {"files": files}
+            if token:
+                resp["nextPageToken"] = token
+            return 200, resp, "application/json"
+
+        # "/<fileId>/export"
+        size = self.dataset.drive_bytes
+        if params.get("mimeType") == "text/csv":
+            row = "a,b,c,d\n"
+            return 200, (row * (size // len(row) + 1)).encode(), "text/csv"
+        html = f"<html><body><h1>Doc</h1><p>{filler(size)}</p></body></html>"
+        return 200, html.encode(), "text/html"
+
+    # -- Calendar ---------------------------------------------------------
+
+    def calendar(self, path: str, params: Dict):
+        size = int(params.get("maxResults", 250))
+        rng, token = page(params.get("pageToken"), size, self.dataset.events)
+        now = self.anchor
+        span = max(self.dataset.events, 1)
+        items = []
+        for i in rng:
+            start = now + timedelta(hours=(i * 180 * 24) // span - 90 * 24)
+            items.append(
+                {
+                    "id": f"event{i}",
+                    "summary": f"Benchmark event {i}",
+                    "description": filler(200),
+                    "location": "Room 1",
+                    "start": {"dateTime": start.isoformat()},
+                    "end": {"dateTime": (start + timedelta(hours=1)).isoformat()},
+                }
+            )
+        resp = {"items": items}
+        if token:
+            resp["nextPageToken"] = token
+        return 200, resp, "application/json"
+
+    # -- Chat -------------------------------------------------------------
+
+    def chat(self, path: str, params: Dict):
+        if path in ("", "/"):
+            rng, token = page(params.get("pageToken"), 100, self.dataset.spaces)
+            resp = {
+                "spaces": [
+                    {"name": f"spaces/space{i}", "displayName": f"Space {i}"}
+                    for i in rng
+                ]
+            }
+        else:
+            # "/space<N>/messages"
+            space = path.strip("/").split("/")[0]
+            size = int(params.get("pageSize", 100))
+            rng, token = page(
+                params.get("pageToken"), size, self.dataset.space_messages
+            )
+            resp = {
+                "messages": [
+                    {
+                        "name": f"spaces/{space}/messages/m{i}",
+                        "sender": {"displayName": f"User {i % 13}"},
+                        "createTime": (EPOCH + timedelta(minutes=i)).isoformat(),
+                        "text": filler(160),
+                    }
+                    for i in rng
+                ]
+            }
+        if token:
+            resp["nextPageToken"] = token
+        return 200, resp, "application/json"
+
+    # -- Slack ------------------------------------------------------------
+
+    def slack(self, method: str, params: Dict):
+        size = int(params.get("limit", 100))
+        if method == "conversations.list":
+            rng, token = page(params.get("cursor"), size, self.dataset.channels)
+            return (
+                200,
+                {
+                    "ok": True,
+                    "channels": [{"id": f"C{i:08d}", "name": f"chan-{i}"} for i in rng],
+                    "response_metadata": {"next_cursor": token},
+                },
+                "application/json",
+            )
+        if method == "conversations.history":
+            # Newest first, ts spread over the last 30 days, filtered by `oldest`.
+            total = self.dataset.channel_messages
+            newest = self.anchor.timestamp()
+            step = 30 * 86400 / max(total, 1)
+            oldest = float(params.get("oldest") or 0)
+            visible = min(total, max(0, math.ceil((newest - oldest) / step)))
+            rng, token = page(params.get("cursor"), size, visible)
+            messages = [
+                {
+                    "type": "message",
+                    "user": f"U{i % 17:04d}",
+                    "ts": f"{newest - i * step:.6f}",
+                    "text": filler(160),
+                }
+                for i in rng
+            ]
+            return (
+                200,
+                {
+                    "ok": True,
+                    "messages": messages,
+                    "has_more": bool(token),
+                    "response_metadata": {"next_cursor": token},
+                },
+                "application/json",
+            )
+        return 200, {"ok": False, "error": "unknown_method"}, "application/json"
+
+    # -- Notion -----------------------------------------------------------
+
+    def notion(self, path: str, params: Dict):
+        size = int(params.get("page_size") or 100)
+        rng, token = page(params.get("start_cursor"), size, self.dataset.notion_pages)
+        results = []
+        for i in rng:
+            item_id = f"00000000-0000-0000-0000-{i:012d}"
+            if i % 10 == 9:
+                results.append(
+                    {
+                        "object": "database",
+                        "id": item_id,
+                        "url": f"https://notion.so/{i}",
+                        "title": [{"plain_text": f"Database {i}"}],
+                    }
+                )
+                continue
+            results.append(
+                {
+                    "object": "page",
+                    "id": item_id,
+                    "url": f"https://notion.so/{i}",
+                    "properties": {
+                        "Name": {
+                            "type": "title",
+                            "title": [{"plain_text": f"Page {i}"}],
+                        },
+                        "Notes": {"type": "rich_text", "rich_text": filler(200)},
+                    },
+                }
+            )
+        return (
+            200,
+            {
+                "object": "list",
+                "results": results,
+                "has_more": bool(token),
+                "next_cursor": token or None,
+            },
+            "application/json",
+        )
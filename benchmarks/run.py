@@ -0,0 +1,213 @@
+import argparse
+import dataclasses
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.fake_api import Dataset, FakeAPI
+from datasync.runner import ROOT, SOURCES, load_syncer, parse_sources
+from datasync.writer import MANIFEST_NAME, load_manifest
+
+# source name -> FakeAPI service name used for call counting
+SERVICES = {
+    "gmail": "gmail",
+    "gdrive": "drive",
+    "gcal": "calendar",
+    "gchat": "chat",
+    "slack": "slack",
+    "notion": "notion",
+}
+
+# Measured values compared against a baseline; higher is worse for all of them.
+COMPARED = ("wall_s", "api_calls", "peak_rss_mb")
+
+
+def build_client(name: str, module, url: str):
+    """Point the real client library for `name` at the fake server at `url`."""
+    if hasattr(module, "SERVICE"):
+        import httplib2
+        from googleapiclient.discovery import build
+
+        # client_options replaces rootUrl + servicePath, so keep the servicePath.
+        service_path = {"gdrive": "drive/v3/", "gcal": "calendar/v3/"}.get(name, "")
+        return build(
+            *module.SERVICE,
+            http=httplib2.Http(),
+            client_options={"api_endpoint": f"{url}/{service_path}"},
+            cache_discovery=False,
+            static_discovery=True,
+        )
+    if name == "slack":
+        from slack_sdk import WebClient
+
+        return WebClient(token="xoxb-benchmark", base_url=f"{url}/api/")
+    if name == "notion":
+        from notion_client import Client
+
+        return Client(auth="secret-benchmark", base_url=url)
+    raise ValueError(name)
+
+
+def run_writes(data_dir: str) -> Dict[str, int]:
+    """Files and bytes the last run wrote, from its metrics file.
+
+    Counting the files in `data_dir` would include the output of earlier runs
+    when --keep reuses a directory.
+    """
+    manifest = load_manifest(os.path.join(data_dir, MANIFEST_NAME))
+    with open(os.path.join(data_dir, "metrics", f"{manifest['run_id']}.json")) as f:
+        metrics = json.load(f)
+    return {
+        "files_written": metrics["files_written"],
+        "bytes_written": metrics["bytes"]["written"],
+    }
+
+
+def run_child(name: str, url: str, data_dir: str) -> Dict:
+    module = load_syncer(name)
+    client = build_client(name, module, url)
+    started = time.perf_counter()
+    module.sync(client, data_dir=data_dir)
+    wall = time.perf_counter() - started
+    result = {
+        "wall_s": round(wall, 3),
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            / (1024 * 1024 if sys.platform == "darwin" else 1024),
+            1,
+        ),
+    }
+    result.update(run_writes(data_dir))
+    return result
+
+
+def run_one(api: FakeAPI, name: str, keep: Optional[str]) -> Dict:
+    if keep:
+        data_dir = os.path.abspath(os.path.join(keep, name, "data"))
+    else:
+        data_dir = tempfile.mkdtemp(prefix=f"{name}-")
+    before = api.snapshot()
+    proc = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks",
+            "--child",
+            name,
+            "--url",
+            api.url,
+            "--data-dir",
+            data_dir,
+        ],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    after = api.snapshot()
+    if not keep:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    service = SERVICES[name]
+    result: Dict = {"source": name}
+    if proc.returncode != 0:
+        result["error"] = f"exit code {proc.returncode}"
+    else:
+        result.update(json.loads(proc.stdout.strip().splitlines()[-1]))
+    for key, label in (("calls", "api_calls"), ("throttled", "throttled_429")):
+        result[label] = after[key].get(service, 0) - before[key].get(service, 0)
+    return result
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    previous = {r["source"]: r for r in baseline}
+    regressions = []
+    for r in results:
+        base = previous.get(r["source"])
+        if not base or "error" in r:
+            continue
+        for key in COMPARED:
+            old, new = base.get(key), r.get(key)
+            if old and new is not None and new > old * (1 + tolerance):
+                regressions.append(f"{r['source']}.{key}: {old} -> {new}")
+    return regressions
+
+
+def print_table(results: List[Dict]) -> None:
+    columns = ["source", "wall_s", "api_calls", "throttled_429", "peak_rss_mb"]
+    columns += ["files_written", "bytes_written"]
+    print(" ".join(f"{c:>14}" for c in columns))
+    for r in results:
+        row = " ".join(f"{str(r.get(c, '-')):>14}" for c in columns)
+        print(row + (f"  ERROR {r['error']}" if "error" in r else ""))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Run the syncers against a local fake API and report cost.",
+    )
+    parser.add_argument("--sources", default=",".join(SOURCES))
+    for field in dataclasses.fields(Dataset):
+        parser.add_argument(
+            "--" + field.name.replace("_", "-"), type=int, default=field.default
+        )
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--throttle-every", type=int, default=0, help="answer every Nth call with 429"
+    )
+    parser.add_argument("--keep", help="write outputs here instead of a temp dir")
+    parser.add_argument("--output", help="save results as JSON")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    # internal: run a single syncer in this (fresh) process
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        # keep the syncer's progress output away from the JSON result line
+        stdout, sys.stdout = sys.stdout, sys.stderr
+        result = run_child(args.child, args.url, args.data_dir)
+        stdout.write(json.dumps(result) + "\n")
+        return 0
+
+    try:
+        names = parse_sources(args.sources)
+    except ValueError as e:
+        parser.error(str(e))
+    dataset = Dataset(
+        **{f.name: getattr(args, f.name) for f in dataclasses.fields(Dataset)}
+    )
+    api = FakeAPI(
+        dataset, latency_ms=args.latency_ms, throttle_every=args.throttle_every
+    ).start()
+    try:
+        results = [run_one(api, name, args.keep) for name in names]
+    finally:
+        api.stop()
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"dataset": dataclasses.asdict(dataset), "results": results},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 1 if any("error" in r for r in results) else 0
@@ -0,0 +1 @@
+"""Shared helpers for running the *-sync templates together from one checkout."""
@@ -0,0 +1,5 @@
+import sys
+
+from datasync.runner import main
+
+sys.exit(main())
@@ -0,0 +1,28 @@
+import time
+from typing import Optional
+
+from datasync.util import env
+
+
+class Budget:
+    """Wall-clock budget for one run.
+
+    SYNC_TIME_BUDGET (seconds) bounds the run; SYNC_TIME_RESERVE (default 60s)
+    is kept back for flushing outputs and saving resume cursors. Without a
+    budget the run is unbounded.
+    """
+
+    def __init__(
+        self,
+        seconds: Optional[float] = None,
+        reserve: Optional[float] = None,
+    ):
+        if seconds is None and env("SYNC_TIME_BUDGET"):
+            seconds = float(env("SYNC_TIME_BUDGET"))
+        if reserve is None:
+            reserve = float(env("SYNC_TIME_RESERVE", "60"))
+        now = time.monotonic()
+        self.deadline = now + max(seconds - reserve, 0) if seconds else None
+
+    def exhausted(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
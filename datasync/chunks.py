@@ -0,0 +1,463 @@
+"""Token-bounded, overlapping chunks of the synced documents for retrieval.
+
+Each document a run creates or modifies (Markdown, Slack JSONL, .eml) is cut
+into chunks that end on line boundaries, stay under CHUNK_MAX_TOKENS tokens
+(default 512; 0 turns chunking off) and repeat about CHUNK_OVERLAP_TOKENS
+(default 64) of the previous chunk. Chunks are appended to
+``data/chunks/chunks.jsonl``; ``data/chunks/chunks.idx`` maps every chunk ID
+to its byte offset and length in that file, its tokens, date and document,
+so a tool can list or read chunks without loading the rest:
+
+    python -m datasync.chunks gmail-sync/data             # the last run's changes
+    python -m datasync.chunks gmail-sync/data --rebuild   # every document, compacted
+    python -m datasync.chunks gmail-sync/data --list      # id, date, tokens, document
+    python -m datasync.chunks gmail-sync/data --get 3f2a9c0d1e4b5a6f
+"""
+
+import argparse
+import email
+import email.policy
+import email.utils
+import functools
+import hashlib
+import json
+import os
+import re
+import sys
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from datasync import layout
+from datasync.mail import message_text, parse_message
+from datasync.util import env
+from datasync.writer import MANIFEST_NAME, Writer
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a length-based estimate
+    tiktoken = None
+
+CHUNK_DIR = "chunks"
+EXTENSIONS = (".md", ".jsonl", ".eml")
+
+# (start, end) byte range in the source file, or None when the text is
+# decoded from it (.eml bodies); plus the text itself.
+Unit = Tuple[Optional[int], Optional[int], str]
+# A line of chunks.idx: chunk ID, byte offset and length in chunks.jsonl,
+# tokens, date ("" if unknown) and document key.
+Row = Tuple[str, int, int, int, str, str]
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:  # the BPE file is fetched on first use; may be offline
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # roughly 4 characters per token for English text and markup, and about
+    # one per character for CJK and other non-ASCII scripts
+    ascii_chars = len(text.encode("ascii", errors="ignore"))
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+def text_units(data: bytes) -> List[Unit]:
+    units = []
+    pos = 0
+    for line in data.splitlines(keepends=True):
+        units.append((pos, pos + len(line), line.decode("utf-8", errors="replace")))
+        pos += len(line)
+    return units
+
+
+def slack_units(data: bytes) -> List[Unit]:
+    # Chunk the readable part of each message; the range still points at the
+    # full JSON line.
+    units = []
+    for start, end, line in text_units(data):
+        try:
+            m = json.loads(line)
+        except ValueError:
+            continue
+        author = m.get("user") or m.get("username") or ""
+        units.append((start, end, f"{author}: {m.get('text', '')}\n"))
+    return units
+
+
+def eml_units(data: bytes) -> List[Unit]:
+    msg = parse_message(data)
+    lines = [f"{key}: {msg.get(key, '')}\n" for key in ("Subject", "From", "To")]
+    lines.append("\n")
+    lines.extend(message_text(msg).splitlines(keepends=True))
+    return [(None, None, line) for line in lines]
+
+
+UNITS: Dict[str, Callable[[bytes], List[Unit]]] = {
+    ".md": text_units,
+    ".jsonl": slack_units,
+    ".eml": eml_units,
+}
+
+
+def split_word(word: str, max_tokens: int) -> List[Tuple[str, int]]:
+    """Cut a run without whitespace (CJK text, URLs, base64) into pieces that fit."""
+    pieces = []
+    while word:
+        # longest prefix within max_tokens, but always at least one character
+        lo, hi = 1, len(word)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if count_tokens(word[:mid]) <= max_tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        pieces.append((word[:lo], count_tokens(word[:lo])))
+        word = word[lo:]
+    return pieces
+
+
+def split_unit(unit: Unit, max_tokens: int) -> List[Tuple[Unit, int]]:
+    """Break a line longer than a whole chunk at word boundaries, or inside words."""
+    start, end, text = unit
+    pieces: List[Tuple[Unit, int]] = []
+    current, tokens = "", 0
+    for word in re.findall(r"\S+\s*|\s+", text):
+        n = count_tokens(word)
+        parts = [(word, n)] if n <= max_tokens else split_word(word, max_tokens)
+        for part, n in parts:
+            if current and tokens + n > max_tokens:
+                pieces.append(((start, end, current), tokens))
+                current, tokens = "", 0
+            current += part
+            tokens += n
+    if current:
+        pieces.append(((start, end, current), tokens))
+    return pieces
+
+
+def chunk_units(
+    units: List[Unit], max_tokens: int, overlap: int
+) -> List[List[Tuple[Unit, int]]]:
+    items: List[Tuple[Unit, int]] = []
+    for unit in units:
+        n = count_tokens(unit[2])
+        if n > max_tokens:
+            items.extend(split_unit(unit, max_tokens))
+        else:
+            items.append((unit, n))
+
+    chunks = []
+    start = 0
+    while start < len(items):
+        end, total = start, 0
+        while end < len(items):
+            if end > start and total + items[end][1] > max_tokens:
+                break
+            total += items[end][1]
+            end += 1
+        chunks.append(items[start:end])
+        if end >= len(items):
+            break
+        # back up whole lines for the overlap, but always move forward
+        back, covered = end, 0
+        while back - 1 > start and covered + items[back - 1][1] <= overlap:
+            back -= 1
+            covered += items[back][1]
+        start = back
+    return chunks
+
+
+def doc_key(data_dir: str, path: str) -> str:
+    """Path below data/ without layout shards, so IDs survive a migration."""
+    for directory in layout.sharded_dirs(data_dir):
+        if os.path.abspath(path).startswith(os.path.abspath(directory) + os.sep):
+            rel = os.path.relpath(directory, data_dir)
+            return f"{rel}/{os.path.basename(path)}".replace(os.sep, "/")
+    return os.path.relpath(path, data_dir).replace(os.sep, "/")
+
+
+def doc_date(path: str, data: bytes) -> Optional[str]:
+    m = layout.DATE_PREFIX.match(os.path.basename(path))
+    if m:
+        return m.group(0)
+    if path.endswith(".eml"):
+        header = email.message_from_bytes(data, policy=email.policy.compat32)["Date"]
+        try:
+            return email.utils.parsedate_to_datetime(header).strftime("%Y-%m-%d")
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def chunk_document(
+    data_dir: str,
+    path: str,
+    rel: str,
+    doc: str,
+    source: str,
+    max_tokens: int,
+    overlap: int,
+) -> Iterator[Dict]:
+    with open(path, "rb") as f:
+        data = f.read()
+    units = UNITS[os.path.splitext(path)[1]](data)
+    date = doc_date(path, data)
+    seen: Set[str] = set()
+    for seq, items in enumerate(chunk_units(units, max_tokens, overlap)):
+        text = "".join(unit[2] for unit, _ in items)
+        if not text.strip():
+            continue
+        # Same document + same text = same ID, however the neighbours change.
+        digest = hashlib.sha1(f"{doc}\0{text}".encode("utf-8")).hexdigest()[:16]
+        chunk_id, n = digest, 1
+        while chunk_id in seen:  # the same text twice in one document
+            n += 1
+            chunk_id = f"{digest}-{n}"
+        seen.add(chunk_id)
+        starts = [unit[0] for unit, _ in items if unit[0] is not None]
+        ends = [unit[1] for unit, _ in items if unit[1] is not None]
+        yield {
+            "id": chunk_id,
+            "doc": doc,
+            "source": source,
+            "path": rel,
+            "date": date,
+            "seq": seq,
+            "start": min(starts) if starts else None,
+            "end": max(ends) if ends else None,
+            "tokens": sum(tokens for _, tokens in items),
+            "text": text,
+        }
+
+
+def is_document(data_dir: str, path: str) -> bool:
+    chunk_dir = os.path.join(os.path.abspath(data_dir), CHUNK_DIR) + os.sep
+    return path.endswith(EXTENSIONS) and not os.path.abspath(path).startswith(
+        chunk_dir
+    )
+
+
+def chunk_paths(data_dir: str) -> Tuple[str, str]:
+    chunk_dir = os.path.join(data_dir, CHUNK_DIR)
+    return (
+        os.path.join(chunk_dir, "chunks.jsonl"),
+        os.path.join(chunk_dir, "chunks.idx"),
+    )
+
+
+def format_row(row: Row) -> str:
+    chunk_id, offset, length, tokens, date, doc = row
+    return f"{chunk_id}\t{offset}\t{length}\t{tokens}\t{date}\t{doc}\n"
+
+
+def load_index(idx_path: str) -> Dict[str, List[Row]]:
+    """Live rows of chunks.idx by document; a document's latest write wins."""
+    docs: Dict[str, List[Row]] = {}
+    if not os.path.exists(idx_path):
+        return docs
+    with open(idx_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break  # partial last line of a killed run
+            if line.startswith("#\t"):
+                # the document was re-chunked or deleted from here on
+                docs[line[2:-1]] = []
+                continue
+            try:
+                chunk_id, offset, length, tokens, date, doc = line[:-1].split("\t", 5)
+                row = (chunk_id, int(offset), int(length), int(tokens), date, doc)
+            except ValueError:
+                continue
+            docs.setdefault(doc, []).append(row)
+    return {doc: rows for doc, rows in docs.items() if rows}
+
+
+def missing_newline(path: str) -> bytes:
+    """b"\\n" if `path` ends in a partial line that an append must not extend."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return b""
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return b"" if f.read(1) == b"\n" else b"\n"
+
+
+def compact(writer: Writer, live: Dict[str, List[Row]]) -> None:
+    """Rewrite chunks.jsonl and chunks.idx with only the live chunks."""
+    jsonl_path, idx_path = chunk_paths(writer.data_dir)
+    with open(jsonl_path, "rb") as f:
+        old = f.read()
+    out = bytearray()
+    lines = []
+    # Live chunks are copied byte for byte, without parsing them.
+    for doc in sorted(live):
+        for chunk_id, offset, length, tokens, date, _ in live[doc]:
+            lines.append(format_row((chunk_id, len(out), length, tokens, date, doc)))
+            out += old[offset : offset + length]
+    writer.write_bytes(jsonl_path, bytes(out))
+    writer.write_text(idx_path, "".join(lines))
+
+
+def update_chunks(writer: Writer, source: str, rebuild: bool = False) -> int:
+    """Re-chunk the documents this run changed; return the number of chunks written.
+
+    New chunks are appended to chunks.jsonl and chunks.idx, superseding the
+    rows of re-chunked or deleted documents; both files are compacted once
+    superseded bytes pass CHUNK_COMPACT_RATIO (default 0.5) of chunks.jsonl.
+    Documents are keyed by the layout-independent document key, so the old
+    and new path of a moved document map to one set of chunks.
+    """
+    max_tokens = int(env("CHUNK_MAX_TOKENS", "512"))
+    overlap = int(env("CHUNK_OVERLAP_TOKENS", "64"))
+    if max_tokens <= 0:
+        return 0
+    data_dir = writer.data_dir
+    jsonl_path, idx_path = chunk_paths(data_dir)
+
+    if rebuild:
+        paths = [
+            os.path.relpath(os.path.abspath(path), writer.root)
+            for path in layout.iter_files(data_dir)
+        ]
+    else:
+        paths = sorted(writer.created | writer.modified | writer.deleted)
+
+    # doc key -> the paths the manifest lists for it (two after a move)
+    docs: Dict[str, List[str]] = {}
+    for rel in paths:
+        path = os.path.join(writer.root, rel)
+        if is_document(data_dir, path):
+            doc = f"{source}:{doc_key(data_dir, path)}"
+            docs.setdefault(doc, []).append(rel)
+    if not docs and not rebuild:
+        return 0
+
+    live = {} if rebuild else load_index(idx_path)
+    base = 0
+    out = bytearray()
+    if not rebuild and os.path.exists(jsonl_path):
+        base = os.path.getsize(jsonl_path)
+        out += missing_newline(jsonl_path)
+    index_lines = []
+    added = 0
+    for doc, rels in sorted(docs.items()):
+        current = [r for r in rels if os.path.exists(os.path.join(writer.root, r))]
+        rows: List[Row] = []
+        if current:
+            rel = current[0]
+            path = os.path.join(writer.root, rel)
+            for record in chunk_document(
+                data_dir, path, rel, doc, source, max_tokens, overlap
+            ):
+                line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                offset, tokens = base + len(out), record["tokens"]
+                date = record["date"] or ""
+                rows.append((record["id"], offset, len(line), tokens, date, doc))
+                out += line
+        if not rows and doc not in live:
+            continue
+        if not rebuild:
+            index_lines.append(f"#\t{doc}\n")
+        index_lines.extend(format_row(row) for row in rows)
+        live[doc] = rows
+        added += len(rows)
+
+    if rebuild:
+        writer.write_bytes(jsonl_path, bytes(out))
+        writer.write_text(idx_path, "".join(index_lines))
+        # e.g. the per-document chunk files of an earlier version
+        for path in list(layout.iter_files(os.path.join(data_dir, CHUNK_DIR))):
+            if path not in (jsonl_path, idx_path):
+                writer.delete(path)
+        return added
+    if not index_lines:
+        return 0
+    writer.append_bytes(jsonl_path, bytes(out))
+    lead = missing_newline(idx_path)
+    writer.append_bytes(idx_path, lead + "".join(index_lines).encode("utf-8"))
+
+    size = base + len(out)
+    stale = size - sum(row[2] for rows in live.values() for row in rows)
+    if stale > float(env("CHUNK_COMPACT_RATIO", "0.5")) * size:
+        compact(writer, live)
+    return added
+
+
+def get_chunk(data_dir: str, chunk_id: str) -> Optional[Dict]:
+    jsonl_path, idx_path = chunk_paths(data_dir)
+    for rows in load_index(idx_path).values():
+        for row in rows:
+            if row[0] == chunk_id:
+                with open(jsonl_path, "rb") as f:
+                    f.seek(row[1])
+                    record = json.loads(f.read(row[2]))
+                # a mismatch means the two files are out of step: --rebuild
+                return record if record.get("id") == chunk_id else None
+    return None
+
+
+def source_name(data_dir: str) -> str:
+    """The source the existing chunks were written for, else the directory name.
+
+    A template's data directory is named after its source (gmail-sync/data),
+    but a copy of the template may live in a repository with any name.
+    """
+    jsonl_path = chunk_paths(data_dir)[0]
+    if os.path.exists(jsonl_path):
+        with open(jsonl_path, "r", encoding="utf-8") as f:
+            line = f.readline()
+        if line.strip():
+            return json.loads(line)["source"]
+    parent = os.path.basename(os.path.dirname(os.path.abspath(data_dir)))
+    return re.sub(r"-sync$", "", parent)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m datasync.chunks",
+        description="Maintain token-bounded chunks of the synced documents.",
+    )
+    parser.add_argument("data_dir", help="a syncer's data directory")
+    parser.add_argument("--source", help="default: the directory name, e.g. gmail")
+    parser.add_argument("--rebuild", action="store_true", help="chunk every document")
+    parser.add_argument("--get", metavar="CHUNK_ID", help="print one chunk's text")
+    parser.add_argument("--list", action="store_true", help="print the live chunks")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.data_dir):
+        parser.error(f"no directory {args.data_dir}")
+    if args.get:
+        chunk = get_chunk(args.data_dir, args.get)
+        if chunk is None:
+            parser.error(f"no chunk {args.get}")
+        print(chunk["text"], end="")
+        return 0
+    if args.list:
+        live = load_index(chunk_paths(args.data_dir)[1])
+        for doc in sorted(live):
+            for chunk_id, _, _, tokens, date, _ in live[doc]:
+                print(f"{chunk_id}\t{date or '-'}\t{tokens}\t{doc}")
+        return 0
+
+    source = args.source or source_name(args.data_dir)
+    manifest_path = os.path.join(args.data_dir, MANIFEST_NAME)
+    if args.rebuild or not os.path.exists(manifest_path):
+        writer = Writer(args.data_dir)
+        rebuild = True
+    else:
+        # add the chunk files to the last run's manifest so they get committed
+        writer = Writer.from_manifest(args.data_dir)
+        rebuild = False
+    added = update_chunks(writer, source, rebuild)
+    writer.save_manifest()
+    print(f"{added} chunk(s) written to {chunk_paths(args.data_dir)[0]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+import threading
+from typing import Optional
+
+import google_auth_httplib2
+import httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+from datasync.util import env
+
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+
+class SharedCredentials(Credentials):
+    """OAuth credentials that can be shared by several services across threads.
+
+    Only one thread refreshes at a time; threads that were waiting on the lock
+    pick up the freshly cached token instead of refreshing again.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self, request) -> None:
+        stale_token = self.token
+        with self._refresh_lock:
+            if self.token != stale_token and self.valid:
+                return
+            super().refresh(request)
+
+
+def build_shared_credentials() -> Optional[SharedCredentials]:
+    client_id = env("GOOGLE_CLIENT_ID")
+    client_secret = env("GOOGLE_CLIENT_SECRET")
+    refresh_token = env("GOOGLE_REFRESH_TOKEN")
+    if not (client_id and client_secret and refresh_token):
+        return None
+    return SharedCredentials(
+        None,
+        refresh_token=refresh_token,
+        token_uri=TOKEN_URI,
+        client_id=client_id,
+        client_secret=client_secret,
+        # No scopes in the refresh request: the token gets whatever the user
+        # granted, so a scope missing for one source fails only that source
+        # (403) instead of the refresh (invalid_scope) for all of them.
+        scopes=None,
+    )
+
+
+def build_service(
+    name: str, version: str, credentials: Credentials, timeout: int = 60
+):
+    # httplib2.Http is not thread-safe, so each service gets its own keep-alive
+    # connection pool; the credentials (and therefore the token) are shared.
+    http = google_auth_httplib2.AuthorizedHttp(
+        credentials, http=httplib2.Http(timeout=timeout)
+    )
+    return build(
+        name, version, http=http, cache_discovery=False, static_discovery=True
+    )
@@ -0,0 +1,166 @@
+"""Sharded layouts for the directories that hold one file per document.
+
+    flat   data/eml/<id>.eml                      (default)
+    hash   data/eml/ab/cd/<id>.eml                sha1 of the file name's stem
+    month  data/calendar/2024/05/2024-05-01.md    names that start with a date;
+                                                  other names are hashed
+
+Pick one with DATA_LAYOUT. After changing it, move the existing files once
+(nothing is downloaded again) and use the same DATA_LAYOUT for scheduled runs:
+
+    python -m datasync.layout migrate gmail-sync/data --scheme hash
+"""
+
+import argparse
+import glob
+import hashlib
+import os
+import re
+import sys
+from typing import Iterator, List, Optional
+
+from datasync.search import SearchIndex, index_path
+from datasync.util import env
+from datasync.writer import Writer
+
+SCHEMES = ("flat", "hash", "month")
+# Directories below data/ that follow the layout; "*" matches one level.
+SHARDED_DIRS = ("eml", "index", "md", "pages", "calendar", "slack/*")
+DATE_PREFIX = re.compile(r"^(\d{4})-(\d{2})-\d{2}")
+
+
+def current_scheme() -> str:
+    scheme = env("DATA_LAYOUT", "flat")
+    if scheme not in SCHEMES:
+        raise ValueError(f"DATA_LAYOUT must be one of {', '.join(SCHEMES)}")
+    return scheme
+
+
+def shard(filename: str, scheme: str) -> str:
+    """Subdirectory for `filename` under `scheme` ("" for flat)."""
+    if scheme == "flat":
+        return ""
+    stem = os.path.splitext(filename)[0]
+    if scheme == "month":
+        m = DATE_PREFIX.match(stem)
+        if m:
+            return os.path.join(m.group(1), m.group(2))
+    digest = hashlib.sha1(stem.encode("utf-8")).hexdigest()
+    return os.path.join(digest[:2], digest[2:4])
+
+
+def path(directory: str, filename: str, scheme: Optional[str] = None) -> str:
+    subdir = shard(filename, scheme or current_scheme())
+    return os.path.join(directory, subdir, filename)
+
+
+def find(directory: str, filename: str) -> Optional[str]:
+    """Existing path of `filename` under any scheme, the current one first."""
+    current = current_scheme()
+    for scheme in (current,) + tuple(s for s in SCHEMES if s != current):
+        candidate = path(directory, filename, scheme)
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def locate(directory: str, filename: str) -> str:
+    """Where to read or write `filename`: its existing path, else the current one.
+
+    Keeping files where they are until `migrate` moves them means a layout
+    change never splits one document across two paths.
+    """
+    return find(directory, filename) or path(directory, filename)
+
+
+def iter_files(directory: str) -> Iterator[str]:
+    """Every document file below `directory`, whatever its layout."""
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.startswith("."):  # e.g. the writer's temp files
+                yield os.path.join(dirpath, filename)
+
+
+def sharded_dirs(data_dir: str) -> List[str]:
+    dirs = []
+    for pattern in SHARDED_DIRS:
+        matches = glob.glob(os.path.join(glob.escape(data_dir), pattern))
+        dirs.extend(d for d in sorted(matches) if os.path.isdir(d))
+    return dirs
+
+
+def remove_empty_dirs(directory: str) -> None:
+    for dirpath, _, _ in sorted(os.walk(directory), reverse=True):
+        if dirpath != directory and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+
+def migrate(
+    data_dir: str,
+    scheme: str,
+    writer: Writer,
+    index: Optional[SearchIndex] = None,
+    dry_run: bool = False,
+) -> int:
+    """Move every sharded file below `data_dir` to its path under `scheme`."""
+    moved = 0
+    for directory in sharded_dirs(data_dir):
+        for src in list(iter_files(directory)):
+            dst = path(directory, os.path.basename(src), scheme)
+            if src == dst:
+                continue
+            if os.path.exists(dst):
+                print(f"Skipping {src}: {dst} already exists")
+                continue
+            moved += 1
+            if dry_run:
+                print(f"{src} -> {dst}")
+                continue
+            writer.move(src, dst)
+            if index is not None:
+                index.move(src, dst)
+        if not dry_run:
+            remove_empty_dirs(directory)
+    return moved
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m datasync.layout",
+        description="Move synced files between directory layouts.",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("migrate", help="move existing files to another layout")
+    cmd.add_argument("data_dir", help="a syncer's data directory")
+    cmd.add_argument("--scheme", choices=SCHEMES, required=True)
+    cmd.add_argument("--db", help="search index whose paths to update")
+    cmd.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.data_dir):
+        parser.error(f"no directory {args.data_dir}")
+    db = args.db or index_path(args.data_dir)
+    writer = Writer(args.data_dir)
+    index = SearchIndex(db) if os.path.exists(db) and not args.dry_run else None
+    try:
+        moved = migrate(args.data_dir, args.scheme, writer, index, args.dry_run)
+    finally:
+        if index is not None:
+            index.close()
+    if args.dry_run:
+        print(f"Would move {moved} file(s)")
+        return 0
+    if moved:
+        # chunk records carry their document's path; point them at the new one
+        from datasync.chunks import source_name, update_chunks
+
+        update_chunks(writer, source_name(args.data_dir))
+    writer.save_manifest()
+    print(f"Moved {moved} file(s) to the {args.scheme} layout")
+    print(f"Set DATA_LAYOUT={args.scheme} for the syncer runs.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
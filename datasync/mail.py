@@ -0,0 +1,25 @@
+"""Readable text of the raw RFC 822 messages the Gmail syncer stores as .eml."""
+
+import email
+import email.policy
+import html
+import re
+from email.message import EmailMessage
+
+
+def parse_message(raw: bytes) -> EmailMessage:
+    return email.message_from_bytes(raw, policy=email.policy.default)
+
+
+def message_text(msg: EmailMessage) -> str:
+    """The text/plain body, else the text/html body with its tags stripped."""
+    try:
+        body = msg.get_body(preferencelist=("plain", "html"))
+        if body is None:
+            return ""
+        text = body.get_content()
+        if body.get_content_type() == "text/html":
+            text = html.unescape(re.sub(r"<[^>]+>", " ", text))
+    except (LookupError, ValueError, AttributeError):
+        return ""
+    return text
@@ -0,0 +1,246 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, Optional, Set
+
+from datasync.util import ensure_dir, env
+
+# Upper bounds (seconds) of the API latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def default_run_id() -> str:
+    return env("SYNC_RUN_ID") or datetime.now(timezone.utc).strftime(
+        "%Y%m%dT%H%M%SZ"
+    )
+
+
+def error_status(e: Exception) -> Optional[int]:
+    """HTTP status of an API error from googleapiclient, slack_sdk or notion_client."""
+    resp = getattr(e, "resp", None)  # googleapiclient.errors.HttpError
+    if resp is not None and getattr(resp, "status", None):
+        return int(resp.status)
+    response = getattr(e, "response", None)  # slack_sdk.errors.SlackApiError
+    if response is not None and getattr(response, "status_code", None):
+        return int(response.status_code)
+    status = getattr(e, "status", None)  # notion_client.APIResponseError
+    return status if isinstance(status, int) else None
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    for holder in (getattr(e, "resp", None), getattr(e, "response", None), e):
+        # httplib2.Response is itself the header dict; the others carry .headers
+        if isinstance(holder, dict):
+            headers = holder
+        else:
+            headers = getattr(holder, "headers", None)
+        if not headers:
+            continue
+        for key in ("retry-after", "Retry-After"):
+            value = headers.get(key)
+            if value:
+                try:
+                    return float(value)
+                except ValueError:
+                    return None
+    return None
+
+
+def response_size(result: Any) -> int:
+    """Body size of an API result, in bytes.
+
+    The client libraries hand back parsed JSON (dicts, or SlackResponse with
+    `.data`), so that is re-encoded compactly. This matches the payload the
+    server sent, leaving out whitespace and transfer compression.
+    """
+    if isinstance(result, bytes):
+        return len(result)
+    if isinstance(result, str):
+        return len(result.encode("utf-8"))
+    data = getattr(result, "data", result)  # slack_sdk.web.SlackResponse
+    if isinstance(data, (bytes, str)):
+        return response_size(data)
+    if isinstance(data, (dict, list)):
+        encoded = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        return len(encoded.encode("utf-8"))
+    return 0
+
+
+class Metrics:
+    """Counters and timings for one sync run of one source."""
+
+    def __init__(self, source: str, run_id: Optional[str] = None):
+        self.source = source
+        self.run_id = run_id or default_run_id()
+        self.max_retries = int(env("SYNC_MAX_RETRIES", "3"))
+        self.started = time.time()
+        self.calls: Dict[str, Dict[str, Any]] = {}
+        self.stages: Dict[str, float] = {}
+        self.bytes: Dict[str, int] = {"downloaded": 0, "written": 0}
+        self.files_written: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def _call_stats(self, name: str) -> Dict[str, Any]:
+        stats = self.calls.get(name)
+        if stats is None:
+            stats = {
+                "count": 0,
+                "errors": 0,
+                "throttled": 0,
+                "retries": 0,
+                "seconds": 0.0,
+                "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+            }
+            self.calls[name] = stats
+        return stats
+
+    def _observe(self, name: str, seconds: float, **increments: int) -> None:
+        with self._lock:
+            stats = self._call_stats(name)
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            bucket = len(LATENCY_BUCKETS)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    bucket = i
+                    break
+            stats["buckets"][bucket] += 1
+            for key, value in increments.items():
+                stats[key] += value
+
+    def call(self, name: str, fn: Callable, *args, **kwargs):
+        """Invoke an API call, timing it and retrying throttled/5xx responses."""
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                status = error_status(e)
+                retry = status in RETRYABLE_STATUSES and attempt < self.max_retries
+                self._observe(
+                    name,
+                    time.perf_counter() - started,
+                    errors=0 if retry else 1,
+                    throttled=1 if status == 429 else 0,
+                    retries=1 if retry else 0,
+                )
+                if not retry:
+                    raise
+                delay = retry_after(e)
+                time.sleep(2**attempt if delay is None else delay)
+                attempt += 1
+                continue
+            self._observe(name, time.perf_counter() - started)
+            self.add_bytes("downloaded", response_size(result))
+            return result
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def add_bytes(self, kind: str, n: int) -> None:
+        with self._lock:
+            self.bytes[kind] = self.bytes.get(kind, 0) + n
+
+    def wrote(self, path: str, nbytes: Optional[int] = None) -> None:
+        """Record a write; pass `nbytes` for appends, otherwise the file size counts."""
+        size = os.path.getsize(path) if nbytes is None else nbytes
+        with self._lock:
+            self.files_written.add(path)
+            self.bytes["written"] += size
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "source": self.source,
+                "run_id": self.run_id,
+                "started": datetime.fromtimestamp(
+                    self.started, timezone.utc
+                ).isoformat(),
+                "duration_s": round(time.time() - self.started, 3),
+                "latency_buckets": list(LATENCY_BUCKETS),
+                "calls": {k: dict(v) for k, v in self.calls.items()},
+                "stages": {k: round(v, 3) for k, v in self.stages.items()},
+                "bytes": dict(self.bytes),
+                "files_written": len(self.files_written),
+            }
+
+    def to_prometheus(self) -> str:
+        data = self.to_dict()
+        src = f'source="{self.source}"'
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP datasync_{name} {help_text}")
+            lines.append(f"# TYPE datasync_{name} {kind}")
+
+        for key, name, help_text in (
+            ("count", "api_calls_total", "API calls, including retried attempts."),
+            ("errors", "api_errors_total", "API calls that failed for good."),
+            ("throttled", "api_throttled_total", "API calls answered with 429."),
+            ("retries", "api_retries_total", "API calls that were retried."),
+        ):
+            metric(name, "counter", help_text)
+            for call, stats in data["calls"].items():
+                lines.append(f'datasync_{name}{{{src},call="{call}"}} {stats[key]}')
+        metric("api_latency_seconds", "histogram", "API call latency.")
+        for call, stats in data["calls"].items():
+            labels = f'{src},call="{call}"'
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), stats["buckets"]):
+                cumulative += n
+                lines.append(
+                    f'datasync_api_latency_seconds_bucket{{{labels},le="{bound}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(
+                f"datasync_api_latency_seconds_sum{{{labels}}} {stats['seconds']:.6f}"
+            )
+            lines.append(
+                f"datasync_api_latency_seconds_count{{{labels}}} {stats['count']}"
+            )
+        metric("stage_seconds", "gauge", "Time spent per stage in the last run.")
+        for stage, seconds in data["stages"].items():
+            lines.append(f'datasync_stage_seconds{{{src},stage="{stage}"}} {seconds}')
+        metric("bytes", "gauge", "Bytes downloaded / written in the last run.")
+        for kind, n in data["bytes"].items():
+            lines.append(f'datasync_bytes{{{src},kind="{kind}"}} {n}')
+        metric("files_written", "gauge", "Files written in the last run.")
+        lines.append(f"datasync_files_written{{{src}}} {data['files_written']}")
+        metric("run_duration_seconds", "gauge", "Duration of the last run.")
+        lines.append(f"datasync_run_duration_seconds{{{src}}} {data['duration_s']}")
+        metric("last_run_timestamp_seconds", "gauge", "Start of the last run.")
+        lines.append(
+            f"datasync_last_run_timestamp_seconds{{{src}}} {int(self.started)}"
+        )
+        return "\n".join(lines) + "\n"
+
+    def emit(self, writer) -> str:
+        """Write data/metrics/<run>.json and, if configured, a Prometheus textfile.
+
+        `writer` is the run's datasync.writer.Writer, so the file shows up in
+        the run manifest like any other output.
+        """
+        path = os.path.join(writer.data_dir, "metrics", f"{self.run_id}.json")
+        writer.write_json(path, self.to_dict())
+
+        textfile_dir = env("METRICS_TEXTFILE_DIR")
+        if textfile_dir:
+            ensure_dir(textfile_dir)
+            prom_path = os.path.join(textfile_dir, f"datasync_{self.source}.prom")
+            # node_exporter may read at any time, so never expose a partial file
+            with open(prom_path + ".tmp", "w") as f:
+                f.write(self.to_prometheus())
+            os.replace(prom_path + ".tmp", prom_path)
+        return path
@@ -0,0 +1,128 @@
+import argparse
+import importlib.util
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from typing import Dict, List, Optional, Tuple
+
+from datasync.util import env
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# source name -> (template directory, module name)
+SOURCES: Dict[str, Tuple[str, str]] = {
+    "gmail": ("gmail-sync", "sync_gmail"),
+    "gdrive": ("gdrive-sync", "sync_gdrive"),
+    "gcal": ("gcal-sync", "sync_gcal"),
+    "gchat": ("gchat-sync", "sync_gchat"),
+    "slack": ("slack-sync", "sync_slack"),
+    "notion": ("notion-sync", "sync_notion"),
+}
+
+
+def load_syncer(name: str, root: str = ROOT) -> ModuleType:
+    directory, module_name = SOURCES[name]
+    path = os.path.join(root, directory, "src", f"{module_name}.py")
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def data_dir_for(name: str, root: str = ROOT) -> str:
+    return os.path.join(root, SOURCES[name][0], "data")
+
+
+def parse_sources(value: str) -> List[str]:
+    names = [n.strip() for n in value.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SOURCES]
+    if unknown:
+        raise ValueError(f"unknown source(s): {', '.join(unknown)}")
+    return names
+
+
+def run_source(
+    name: str, module: ModuleType, root: str, credentials=None
+) -> Optional[str]:
+    """Run one syncer and return an error description instead of raising."""
+    started = time.monotonic()
+    try:
+        client = None
+        if credentials is not None and hasattr(module, "SERVICE"):
+            from datasync.google import build_service
+
+            client = build_service(*module.SERVICE, credentials)
+        module.sync(client, data_dir=data_dir_for(name, root))
+    except Exception as e:  # one broken source must not take the others down
+        traceback.print_exc()
+        return f"{type(e).__name__}: {e}"
+    finally:
+        print(f"[{name}] finished in {time.monotonic() - started:.1f}s")
+    return None
+
+
+def run(names: List[str], root: str = ROOT, workers: Optional[int] = None) -> Dict:
+    failures: Dict[str, str] = {}
+    modules: Dict[str, ModuleType] = {}
+    for name in names:
+        try:
+            modules[name] = load_syncer(name, root)
+        except Exception as e:
+            traceback.print_exc()
+            failures[name] = f"{type(e).__name__}: {e}"
+
+    # One search index for all sources instead of one per data directory.
+    os.environ.setdefault(
+        "SEARCH_INDEX_PATH", os.path.join(root, "data", "search.sqlite")
+    )
+
+    credentials = None
+    if any(hasattr(module, "SERVICE") for module in modules.values()):
+        from datasync.google import build_shared_credentials
+
+        credentials = build_shared_credentials()
+        if credentials is None:
+            print("GOOGLE_* secrets not set; Google syncers use their own.")
+
+    with ThreadPoolExecutor(max_workers=workers or len(modules) or 1) as pool:
+        futures = {
+            name: pool.submit(run_source, name, module, root, credentials)
+            for name, module in modules.items()
+        }
+        for name, future in futures.items():
+            error = future.result()
+            if error:
+                failures[name] = error
+
+    for name in names:
+        print(f"{name}: {'FAILED ' + failures[name] if name in failures else 'ok'}")
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m datasync",
+        description="Run several syncers concurrently in one process.",
+    )
+    parser.add_argument(
+        "--sources",
+        default=env("SYNC_SOURCES", ",".join(SOURCES)),
+        help="comma-separated subset of: " + ", ".join(SOURCES),
+    )
+    parser.add_argument("--root", default=ROOT, help="checkout holding *-sync/")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    try:
+        names = parse_sources(args.sources)
+    except ValueError as e:
+        parser.error(str(e))
+    failures = run(names, root=args.root, workers=args.workers)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""Full-text search index (SQLite FTS5) over the documents the syncers write.
+
+Syncers upsert each document as they write it, so an incremental run only
+touches the rows for documents it changed. Every write commits on its own.
+Query from the command line, or index the files already on disk (after the
+index was lost, or for an archive synced before indexing existed):
+
+    python -m datasync.search "quarterly plan" --source gdrive --limit 5
+    python -m datasync.search --reindex gmail-sync/data
+"""
+
+import argparse
+import glob
+import importlib.util
+import os
+import sqlite3
+import sys
+from typing import Dict, List, Optional
+
+from datasync.util import ensure_dir, env
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    date TEXT,
+    path TEXT,
+    title TEXT,
+    body TEXT,
+    UNIQUE (source, doc_id)
+);
+CREATE INDEX IF NOT EXISTS documents_date ON documents (source, date);
+CREATE INDEX IF NOT EXISTS documents_path ON documents (path);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    title, body,
+    content='documents', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+    INSERT INTO documents_fts (rowid, title, body)
+    VALUES (new.id, new.title, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+    INSERT INTO documents_fts (documents_fts, rowid, title, body)
+    VALUES ('delete', old.id, old.title, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE ON documents BEGIN
+    INSERT INTO documents_fts (documents_fts, rowid, title, body)
+    VALUES ('delete', old.id, old.title, old.body);
+    INSERT INTO documents_fts (rowid, title, body)
+    VALUES (new.id, new.title, new.body);
+END;
+"""
+
+UPSERT = """
+INSERT INTO documents (source, doc_id, date, path, title, body)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (source, doc_id) DO UPDATE SET
+    date = COALESCE(excluded.date, documents.date),
+    path = excluded.path,
+    title = excluded.title,
+    body = excluded.body
+WHERE documents.body IS NOT excluded.body
+   OR documents.title IS NOT excluded.title
+   OR documents.path IS NOT excluded.path
+   OR (excluded.date IS NOT NULL AND documents.date IS NOT excluded.date)
+"""
+
+QUERY = """
+SELECT d.source, d.doc_id, d.date, d.path, d.title,
+       snippet(documents_fts, 1, '[', ']', '…', 16) AS snippet,
+       bm25(documents_fts, 5.0, 1.0) AS score
+FROM documents_fts
+JOIN documents d ON d.id = documents_fts.rowid
+WHERE documents_fts MATCH ? {where}
+ORDER BY score
+LIMIT ?
+"""
+
+
+def index_path(data_dir: str) -> str:
+    """Index file; set SEARCH_INDEX_PATH to share one file across sources."""
+    return env("SEARCH_INDEX_PATH") or os.path.join(data_dir, "search.sqlite")
+
+
+def to_match_query(text: str) -> str:
+    # Quote every term so user input like "foo-bar" or "c++" is not FTS syntax.
+    return " ".join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+
+class SearchIndex:
+    def __init__(self, path: str):
+        ensure_dir(os.path.dirname(path) or ".")
+        self.path = path
+        # Paths are stored relative to the directory above the index's, i.e.
+        # the checkout root for data/search.sqlite, so a hit's path opens
+        # from there for per-template and shared indexes alike.
+        self.root = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+        # Several syncers may share one index file from the runner's threads.
+        # Autocommit keeps every write transaction to a single statement, so
+        # no syncer holds the write lock across its API calls; with WAL and
+        # synchronous=NORMAL a commit is not an fsync, so this stays cheap.
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self) -> "SearchIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _relpath(self, path: Optional[str]) -> Optional[str]:
+        return os.path.relpath(os.path.abspath(path), self.root) if path else None
+
+    def upsert(
+        self,
+        source: str,
+        doc_id: str,
+        title: str,
+        body: str,
+        date: Optional[str] = None,
+        path: Optional[str] = None,
+    ) -> None:
+        rel = self._relpath(path)
+        if rel is not None:
+            # one row per file, even if a reindex guessed a different ID for it
+            self.conn.execute(
+                "DELETE FROM documents WHERE path = ? AND source = ? AND doc_id != ?",
+                (rel, source, doc_id),
+            )
+        self.conn.execute(UPSERT, (source, doc_id, date, rel, title, body))
+
+    def delete(self, source: str, doc_id: str) -> None:
+        self.conn.execute(
+            "DELETE FROM documents WHERE source = ? AND doc_id = ?", (source, doc_id)
+        )
+
+    def move(self, old_path: str, new_path: str) -> None:
+        """Point rows stored under `old_path` at `new_path`."""
+        self.conn.execute(
+            "UPDATE documents SET path = ? WHERE path = ?",
+            (self._relpath(new_path), self._relpath(old_path)),
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def search(
+        self,
+        text: str,
+        source: Optional[str] = None,
+        limit: int = 10,
+        raw: bool = False,
+    ) -> List[Dict]:
+        params: List = [text if raw else to_match_query(text)]
+        where = ""
+        if source:
+            where = "AND d.source = ?"
+            params.append(source)
+        params.append(limit)
+        cur = self.conn.execute(QUERY.format(where=where), params)
+        columns = [c[0] for c in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def reindex(data_dir: str, db: str) -> int:
+    """Index the documents already in a syncer's `data_dir`; return how many.
+
+    The syncer's own `reindex` knows its file formats; it is loaded from the
+    src/ directory next to `data_dir`, as in every template.
+    """
+    scripts = glob.glob(
+        os.path.join(os.path.dirname(os.path.abspath(data_dir)), "src", "sync_*.py")
+    )
+    if len(scripts) != 1:
+        raise ValueError(f"expected one src/sync_*.py next to {data_dir}")
+    name = os.path.splitext(os.path.basename(scripts[0]))[0]
+    spec = importlib.util.spec_from_file_location(name, scripts[0])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    with SearchIndex(db) as index:
+        return module.reindex(index, data_dir)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m datasync.search", description="Search the synced documents."
+    )
+    parser.add_argument("query", nargs="?")
+    parser.add_argument("--db", help="default: data/search.sqlite")
+    parser.add_argument(
+        "--reindex", metavar="DATA_DIR", help="index the files in a data directory"
+    )
+    parser.add_argument("--source", help="gmail, gdrive, gcal, gchat, slack, notion")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument(
+        "--raw", action="store_true", help="pass the query through as FTS5 syntax"
+    )
+    args = parser.parse_args(argv)
+
+    if args.reindex:
+        if not os.path.isdir(args.reindex):
+            parser.error(f"no directory {args.reindex}")
+        db = args.db or index_path(args.reindex)
+        try:
+            count = reindex(args.reindex, db)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Indexed {count} document(s) from {args.reindex} into {db}")
+        return 0
+    if args.query is None:
+        parser.error("a query or --reindex is required")
+    db = args.db or index_path("data")
+    if not os.path.exists(db):
+        parser.error(f"no index at {db}")
+    with SearchIndex(db) as index:
+        try:
+            hits = index.search(args.query, args.source, args.limit, raw=args.raw)
+        except sqlite3.OperationalError as e:
+            parser.error(f"bad query: {e}")
+    for hit in hits:
+        print(f"{hit['source']}\t{hit['date'] or '-'}\t{hit['path'] or hit['doc_id']}")
+        print(f"    {hit['title'] or ''}: {' '.join(hit['snippet'].split())}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
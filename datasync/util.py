@@ -0,0 +1,11 @@
+import os
+from typing import Optional
+
+
+def ensure_dir(path: str) -> None:
+    os.makedirs(path, exist_ok=True)
+
+
+def env(name: str, default: Optional[str] = None) -> Optional[str]:
+    val = os.getenv(name)
+    return val if val is not None and val != "" else default
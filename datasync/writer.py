@@ -0,0 +1,214 @@
+"""Change-aware atomic file writes with a per-run manifest of changed paths.
+
+Identical content is never rewritten, so mtimes and git stay quiet; new
+content goes through a temp file plus rename, so a killed run never leaves a
+half-written file. Every created, modified or deleted path is recorded and
+saved to ``data/manifest.json`` for the commit step and downstream indexers:
+
+    python -m datasync.writer data/manifest.json   # paths to `git add`
+    python -m datasync.writer --deleted data/manifest.json   # paths to `git rm`
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional, Set
+
+from datasync.metrics import Metrics, default_run_id
+from datasync.util import ensure_dir
+
+MANIFEST_NAME = "manifest.json"
+
+
+def file_digest(path: str) -> bytes:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.digest()
+
+
+def same_content(path: str, data: bytes) -> bool:
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    # A size mismatch settles it without reading the old file.
+    return size == len(data) and file_digest(path) == hashlib.sha256(data).digest()
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """Replace `path` with `data` through a temp file in the same directory."""
+    directory = os.path.dirname(path) or "."
+    ensure_dir(directory)
+    fd, tmp = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)  # mkstemp creates 0600 files
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class Writer:
+    """Writes the files of one sync run below `data_dir`."""
+
+    def __init__(self, data_dir: str, metrics: Optional[Metrics] = None):
+        self.data_dir = data_dir
+        self.metrics = metrics
+        self.run_id = metrics.run_id if metrics else default_run_id()
+        # Manifest paths are relative to the repository root holding data/.
+        self.root = os.path.dirname(os.path.abspath(data_dir))
+        self.created: Set[str] = set()
+        self.modified: Set[str] = set()
+        self.deleted: Set[str] = set()
+
+    @classmethod
+    def from_manifest(cls, data_dir: str, metrics: Optional[Metrics] = None):
+        """Continue the run recorded in `data_dir`'s manifest, e.g. a later stage."""
+        manifest = load_manifest(os.path.join(data_dir, MANIFEST_NAME))
+        writer = cls(data_dir, metrics)
+        writer.run_id = manifest["run_id"]
+        writer.created.update(manifest["created"])
+        writer.modified.update(manifest["modified"])
+        writer.deleted.update(manifest["deleted"])
+        return writer
+
+    def _relpath(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def record(self, path: str, created: bool = False) -> None:
+        """Note a change made to `path` outside the writer."""
+        rel = self._relpath(path)
+        self.deleted.discard(rel)
+        if created or rel in self.created:
+            self.created.add(rel)
+        else:
+            self.modified.add(rel)
+
+    def write_bytes(self, path: str, data: bytes) -> bool:
+        """Write `data` unless `path` already holds exactly that; True if written."""
+        if same_content(path, data):
+            return False
+        existed = os.path.exists(path)
+        atomic_write(path, data)
+        self.record(path, created=not existed)
+        if self.metrics is not None:
+            self.metrics.wrote(path, len(data))
+        return True
+
+    def write_text(self, path: str, text: str) -> bool:
+        return self.write_bytes(path, text.encode("utf-8"))
+
+    def write_json(self, path: str, data: Any) -> bool:
+        return self.write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+
+    def append_text(self, path: str, text: str) -> bool:
+        """Append by rewriting atomically; batch appends to keep this cheap."""
+        existing = b""
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                existing = f.read()
+        return self.write_bytes(path, existing + text.encode("utf-8"))
+
+    def append_bytes(self, path: str, data: bytes) -> None:
+        """Append in place, without rewriting the file: for large append-only logs.
+
+        Unlike the other writes this is not atomic; a killed run can leave a
+        partial last line, which readers of such a log must skip.
+        """
+        if not data:
+            return
+        existed = os.path.exists(path)
+        ensure_dir(os.path.dirname(path) or ".")
+        with open(path, "ab") as f:
+            f.write(data)
+        self.record(path, created=not existed)
+        if self.metrics is not None:
+            self.metrics.wrote(path, len(data))
+
+    def _removed(self, path: str) -> None:
+        rel = self._relpath(path)
+        if rel in self.created:
+            # created and removed within this run: nothing to report
+            self.created.discard(rel)
+        else:
+            self.modified.discard(rel)
+            self.deleted.add(rel)
+
+    def delete(self, path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        self._removed(path)
+        return True
+
+    def move(self, src: str, dst: str) -> None:
+        """Rename `src` to `dst`, recorded as a delete plus a create."""
+        ensure_dir(os.path.dirname(dst) or ".")
+        os.replace(src, dst)
+        self._removed(src)
+        self.record(dst, created=True)
+
+    def manifest(self) -> Dict[str, Any]:
+        return {
+            "run_id": self.run_id,
+            "created": sorted(self.created),
+            "modified": sorted(self.modified),
+            "deleted": sorted(self.deleted),
+        }
+
+    def save_manifest(self) -> str:
+        path = os.path.join(self.data_dir, MANIFEST_NAME)
+        text = json.dumps(self.manifest(), ensure_ascii=False, indent=2)
+        atomic_write(path, text.encode("utf-8"))
+        return path
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def changed_paths(manifest_path: str, deleted: bool = False) -> List[str]:
+    """Paths from a manifest, relative to the current directory.
+
+    By default the created and modified paths (and the manifest itself);
+    with `deleted`, the deleted ones. Paths whose file state no longer matches
+    are left out, so a stale manifest from a skipped run stays harmless.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(manifest_path)))
+    manifest = load_manifest(manifest_path)
+    keys = ("deleted",) if deleted else ("created", "modified")
+    paths = [] if deleted else [os.path.relpath(manifest_path)]
+    for key in keys:
+        paths.extend(os.path.relpath(os.path.join(root, p)) for p in manifest[key])
+    return [p for p in paths if os.path.exists(p) != deleted]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m datasync.writer",
+        description="Print the paths recorded in sync run manifests.",
+    )
+    parser.add_argument("manifests", nargs="*", help="missing files are ignored")
+    parser.add_argument("--deleted", action="store_true")
+    args = parser.parse_args(argv)
+
+    for manifest_path in args.manifests:
+        if os.path.exists(manifest_path):
+            for path in changed_paths(manifest_path, args.deleted):
+                print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
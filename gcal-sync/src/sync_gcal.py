@@ -1,4 +1,3 @@
-import json
 import os
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, List
@@ -7,9 +6,14 @@ import pytz
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 
+from datasync import layout
+from datasync.chunks import update_chunks
+from datasync.metrics import Metrics
+from datasync.search import SearchIndex, index_path
+from datasync.writer import Writer
 
-def ensure_dir(path: str) -> None:
-    os.makedirs(path, exist_ok=True)
+SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
+SERVICE = ("calendar", "v3")
 
 
 def env(name: str, default: Optional[str] = None) -> Optional[str]:
@@ -30,14 +34,17 @@ def build_calendar_client():
         token_uri="https://oauth2.googleapis.com/token",
         client_id=client_id,
         client_secret=client_secret,
-        scopes=["https://www.googleapis.com/auth/calendar.readonly"],
+        scopes=SCOPES,
+    )
+    return build(
+        *SERVICE, credentials=creds, cache_discovery=False, static_discovery=True
     )
-    return build("calendar", "v3", credentials=creds, cache_discovery=False)
 
 
-def write_daily_markdown(day: datetime, events: List[Dict]) -> None:
-    ensure_dir(os.path.join("data", "calendar"))
-    path = os.path.join("data", "calendar", day.strftime("%Y-%m-%d") + ".md")
+def write_daily_markdown(writer: Writer, day: datetime, events: List[Dict]) -> str:
+    path = layout.locate(
+        os.path.join(writer.data_dir, "calendar"), day.strftime("%Y-%m-%d") + ".md"
+    )
     lines = [f"# {day.strftime('%Y-%m-%d')}"]
     events_sorted = sorted(events, key=lambda e: e.get("start_dt") or "")
     for e in events_sorted:
@@ -50,8 +57,26 @@ def write_daily_markdown(day: datetime, events: List[Dict]) -> None:
         desc = e.get("description")
         if desc:
             lines.append(f"  \n  {desc.strip()}")
-    with open(path, "w") as f:
-        f.write("\n".join(lines) + "\n")
+    writer.write_text(path, "\n".join(lines) + "\n")
+    return path
+
+
+def index_day(index: SearchIndex, day_str: str, path: str) -> None:
+    # the day's Markdown without its "# <day>" heading, so a reindex from the
+    # files produces the same row as the sync
+    with open(path, "r", encoding="utf-8") as f:
+        body = f.read().partition("\n")[2]
+    index.upsert("gcal", day_str, day_str, body, day_str, path)
+
+
+def reindex(index: SearchIndex, data_dir: str) -> int:
+    """Index every day file already in `data_dir`, e.g. after the index was lost."""
+    count = 0
+    for path in layout.iter_files(os.path.join(data_dir, "calendar")):
+        if path.endswith(".md"):
+            index_day(index, os.path.basename(path)[: -len(".md")], path)
+            count += 1
+    return count
 
 
 def parse_event_dates(event: Dict, tz: pytz.BaseTzInfo) -> Dict:
@@ -79,11 +104,14 @@ def parse_event_dates(event: Dict, tz: pytz.BaseTzInfo) -> Dict:
     return event
 
 
-def sync() -> None:
-    cal = build_calendar_client()
+def sync(cal=None, data_dir: str = "data") -> None:
+    if cal is None:
+        cal = build_calendar_client()
     if cal is None:
         return
 
+    metrics = Metrics("gcal")
+    writer = Writer(data_dir, metrics)
     calendar_id = env("GCAL_CALENDAR_ID", "primary")
     tz = pytz.timezone("UTC")
     now = datetime.now(timezone.utc)
@@ -93,19 +121,21 @@ def sync() -> None:
     events: List[Dict] = []
     page_token = None
     while True:
-        resp = (
-            cal.events()
-            .list(
-                calendarId=calendar_id,
-                singleEvents=True,
-                orderBy="startTime",
-                timeMin=start,
-                timeMax=end,
-                pageToken=page_token,
-                maxResults=2500,
+        with metrics.stage("list"):
+            resp = metrics.call(
+                "events.list",
+                cal.events()
+                .list(
+                    calendarId=calendar_id,
+                    singleEvents=True,
+                    orderBy="startTime",
+                    timeMin=start,
+                    timeMax=end,
+                    pageToken=page_token,
+                    maxResults=2500,
+                )
+                .execute,
             )
-            .execute()
-        )
         for e in resp.get("items", []):
             e = parse_event_dates(e, tz)
             events.append(
@@ -128,19 +158,37 @@ def sync() -> None:
         day = e["start_dt"][:10]
         buckets.setdefault(day, []).append(e)
 
+    index = SearchIndex(index_path(data_dir))
     for day_str, day_events in buckets.items():
         day = datetime.fromisoformat(day_str + "T00:00:00+00:00")
-        write_daily_markdown(day, day_events)
-
-    ensure_dir("data")
-    with open(os.path.join("data", "state.json"), "w") as f:
-        json.dump(
-            {"last_run": datetime.now(timezone.utc).isoformat(), "events": len(events)},
-            f,
-            ensure_ascii=False,
-            indent=2,
-        )
+        with metrics.stage("write"):
+            path = write_daily_markdown(writer, day, day_events)
+        with metrics.stage("index"):
+            index_day(index, day_str, path)
+
+    # Days fully inside the window that no longer have events (e.g. the only
+    # meeting was cancelled) would otherwise keep a stale file forever.
+    for path in layout.iter_files(os.path.join(data_dir, "calendar")):
+        filename = os.path.basename(path)
+        day_str = filename[:-3]
+        if (
+            filename.endswith(".md")
+            and start[:10] < day_str < end[:10]
+            and day_str not in buckets
+        ):
+            writer.delete(path)
+            index.delete("gcal", day_str)
+    index.close()
+
+    writer.write_json(
+        os.path.join(data_dir, "state.json"),
+        {"last_run": datetime.now(timezone.utc).isoformat(), "events": len(events)},
+    )
     print(f"Wrote {len(events)} events into daily Markdown files")
+    with metrics.stage("chunk"):
+        update_chunks(writer, "gcal")
+    metrics.emit(writer)
+    writer.save_manifest()
 
 
 if __name__ == "__main__":
@@ -1,19 +1,22 @@
 import json
 import os
-from typing import Optional, Any
+from typing import Any, List, Optional
 
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 
+from datasync.budget import Budget
+from datasync.chunks import update_chunks
+from datasync.metrics import Metrics
+from datasync.search import SearchIndex, index_path
+from datasync.writer import Writer
+
 SCOPES = [
     "https://www.googleapis.com/auth/chat.spaces.readonly",
     "https://www.googleapis.com/auth/chat.messages.readonly",
     "https://www.googleapis.com/auth/chat.memberships.readonly",
 ]
-
-
-def ensure_dir(path: str) -> None:
-    os.makedirs(path, exist_ok=True)
+SERVICE = ("chat", "v1")
 
 
 def env(name: str, default: Optional[str] = None) -> Optional[str]:
@@ -21,9 +24,47 @@ def env(name: str, default: Optional[str] = None) -> Optional[str]:
     return val if val is not None and val != "" else default
 
 
-def save_json(path: str, data: Any) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def save_json(writer: Writer, path: str, data: Any) -> None:
+    writer.write_json(path, data)
+
+
+def index_space(
+    index: SearchIndex, space_id: str, display_name: str, messages: List, path: str
+) -> None:
+    body = "\n".join(
+        f"{msg.get('sender', {}).get('displayName', 'Unknown')}: {msg.get('text', '')}"
+        for msg in reversed(messages)
+    )
+    latest = max(msg.get("createTime") or "" for msg in messages)
+    index.upsert("gchat", space_id, display_name, body, latest[:10] or None, path)
+
+
+def reindex(index: SearchIndex, data_dir: str) -> int:
+    """Index every space already in `data_dir`, e.g. after the index was lost."""
+    count = 0
+    spaces_dir = os.path.join(data_dir, "spaces")
+    if not os.path.isdir(spaces_dir):
+        return 0
+    for filename in sorted(os.listdir(spaces_dir)):
+        if not filename.endswith(".json"):
+            continue
+        # spaces/<name>.json goes with messages/<name>/
+        messages_dir = os.path.join(data_dir, "messages", filename[: -len(".json")])
+        json_path = os.path.join(messages_dir, "messages.json")
+        if not os.path.exists(json_path):
+            continue
+        with open(os.path.join(spaces_dir, filename), "r", encoding="utf-8") as f:
+            space = json.load(f)
+        with open(json_path, "r", encoding="utf-8") as f:
+            messages = json.load(f)
+        if messages:
+            space_id = space["name"].split("/")[-1]
+            md_path = os.path.join(messages_dir, "messages.md")
+            index_space(
+                index, space_id, space.get("displayName", "Untitled"), messages, md_path
+            )
+            count += 1
+    return count
 
 
 def build_chat_client():
@@ -43,19 +84,29 @@ def build_chat_client():
         client_secret=client_secret,
         scopes=SCOPES,
     )
-    return build("chat", "v1", credentials=creds, cache_discovery=False)
+    return build(
+        *SERVICE, credentials=creds, cache_discovery=False, static_discovery=True
+    )
 
 
-def sync() -> None:
-    service = build_chat_client()
+def sync(service=None, data_dir: str = "data") -> None:
+    if service is None:
+        service = build_chat_client()
     if service is None:
         return
 
+    metrics = Metrics("gchat")
+    budget = Budget()
+    writer = Writer(data_dir, metrics)
+    index = SearchIndex(index_path(data_dir))
     print("GChat: Fetching spaces...")
     spaces = []
     page_token = None
     while True:
-        resp = service.spaces().list(pageToken=page_token).execute()
+        with metrics.stage("list"):
+            resp = metrics.call(
+                "spaces.list", service.spaces().list(pageToken=page_token).execute
+            )
         spaces.extend(resp.get("spaces", []))
         page_token = resp.get("nextPageToken")
         if not page_token:
@@ -63,12 +114,32 @@ def sync() -> None:
 
     print(f"GChat: Found {len(spaces)} spaces.")
 
-    ensure_dir(os.path.join("data", "spaces"))
-
+    # A run that hit its time budget records the space it stopped at and the
+    # next message page of that space; start there so every space gets
+    # refreshed even if one run can't cover them all, or one space is too big.
+    state_path = os.path.join(data_dir, "state.json")
+    resume_space = resume_token = None
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        resume_space = saved.get("resume_space")
+        resume_token = saved.get("page_token")
+    names = [space.get("name") for space in spaces]
+    if resume_space in names:
+        start = names.index(resume_space)
+        spaces = spaces[start:] + spaces[:start]
+        print(f"GChat: Resuming at {resume_space}")
+
+    stopped_at = stopped_token = None
     for space in spaces:
         space_name = space.get("name")  # e.g. spaces/AAAA...
         if not space_name:
             continue
+        if budget.exhausted():
+            stopped_at = space_name
+            if space_name == resume_space:
+                stopped_token = resume_token
+            break
 
         space_id = space_name.split("/")[-1]
         display_name = space.get("displayName", "Untitled")
@@ -81,11 +152,23 @@ def sync() -> None:
         print(f"GChat: Syncing space {display_name} ({space_id})...")
 
         # Save space info
-        save_json(os.path.join("data", "spaces", f"{safe_name}_{space_id}.json"), space)
+        space_path = os.path.join(data_dir, "spaces", f"{safe_name}_{space_id}.json")
+        with metrics.stage("write"):
+            save_json(writer, space_path, space)
+
+        messages_dir = os.path.join(data_dir, "messages", f"{safe_name}_{space_id}")
+        # messages fetched so far by a run that stopped inside this space
+        partial_path = os.path.join(messages_dir, "messages.partial.json")
 
         # List messages
         messages = []
         msg_page_token = None
+        if space_name == resume_space and resume_token:
+            if os.path.exists(partial_path):
+                with open(partial_path, "r", encoding="utf-8") as f:
+                    messages = json.load(f)
+            msg_page_token = resume_token
+            print(f"GChat: Continuing after {len(messages)} message(s)")
         # Limit to recent messages or fetch all? Let's fetch a reasonable amount or all if possible.
         # Note: Listing messages might take a while for large spaces.
         # For now, let's just fetch the first page or so to verify it works, or loop until done.
@@ -94,18 +177,24 @@ def sync() -> None:
 
         try:
             while True:
+                if budget.exhausted():
+                    stopped_at = space_name
+                    stopped_token = msg_page_token
+                    break
                 # filter=None fetches all messages? Or do we need to specify something?
                 # The API documentation says 'parent' is required.
-                msg_resp = (
-                    service.spaces()
-                    .messages()
-                    .list(
-                        parent=space_name,
-                        pageToken=msg_page_token,
-                        pageSize=1000,  # Max is 1000
+                with metrics.stage("fetch"):
+                    msg_resp = metrics.call(
+                        "spaces.messages.list",
+                        service.spaces()
+                        .messages()
+                        .list(
+                            parent=space_name,
+                            pageToken=msg_page_token,
+                            pageSize=1000,  # Max is 1000
+                        )
+                        .execute,
                     )
-                    .execute()
-                )
 
                 msgs = msg_resp.get("messages", [])
                 messages.extend(msgs)
@@ -115,26 +204,46 @@ def sync() -> None:
                     break
         except Exception as e:
             print(f"GChat: Error fetching messages for {space_name}: {e}")
+        if stopped_at:
+            # Keep the pages fetched so far next to the space's files (which
+            # stay untouched) and continue from the next page on the next run.
+            if stopped_token and messages:
+                with metrics.stage("write"):
+                    save_json(writer, partial_path, messages)
+            break
+        writer.delete(partial_path)
 
         # Save messages
         if messages:
-            messages_dir = os.path.join("data", "messages", f"{safe_name}_{space_id}")
-            ensure_dir(messages_dir)
-
-            # Save as one big JSON or split? One big JSON for now.
-            save_json(os.path.join(messages_dir, "messages.json"), messages)
-
-            # Create a markdown summary
-            md_path = os.path.join(messages_dir, "messages.md")
-            with open(md_path, "w", encoding="utf-8") as f:
-                f.write(f"# {display_name}\n\n")
+            with metrics.stage("write"):
+                # Save as one big JSON or split? One big JSON for now.
+                json_path = os.path.join(messages_dir, "messages.json")
+                save_json(writer, json_path, messages)
+
+                # Create a markdown summary
+                md_path = os.path.join(messages_dir, "messages.md")
+                parts = [f"# {display_name}\n\n"]
                 for msg in reversed(messages):  # Oldest first
                     sender = msg.get("sender", {}).get("displayName", "Unknown")
                     create_time = msg.get("createTime")
                     text = msg.get("text", "")
-                    f.write(f"**{sender}** ({create_time}):\n{text}\n\n")
+                    parts.append(f"**{sender}** ({create_time}):\n{text}\n\n")
+                writer.write_text(md_path, "".join(parts))
 
+            with metrics.stage("index"):
+                index_space(index, space_id, display_name, messages, md_path)
+
+    index.close()
+    save_json(
+        writer, state_path, {"resume_space": stopped_at, "page_token": stopped_token}
+    )
+    if stopped_at:
+        print(f"GChat: Time budget reached; will resume at {stopped_at}")
     print("GChat: Sync complete.")
+    with metrics.stage("chunk"):
+        update_chunks(writer, "gchat")
+    metrics.emit(writer)
+    writer.save_manifest()
 
 
 if __name__ == "__main__":
@@ -2,16 +2,22 @@ import csv
 import io
 import json
 import os
-from typing import Optional
+from typing import Dict, Optional
 
 import html2text
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from datasync import layout
+from datasync.budget import Budget
+from datasync.chunks import update_chunks
+from datasync.metrics import Metrics
+from datasync.search import SearchIndex, index_path
+from datasync.writer import Writer
 
-def ensure_dir(path: str) -> None:
-    os.makedirs(path, exist_ok=True)
+SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
+SERVICE = ("drive", "v3")
 
 
 def env(name: str, default: Optional[str] = None) -> Optional[str]:
@@ -32,9 +38,22 @@ def build_drive_client():
         token_uri="https://oauth2.googleapis.com/token",
         client_id=client_id,
         client_secret=client_secret,
-        scopes=["https://www.googleapis.com/auth/drive.readonly"],
+        scopes=SCOPES,
     )
-    return build("drive", "v3", credentials=creds, cache_discovery=False)
+    return build(
+        *SERVICE, credentials=creds, cache_discovery=False, static_discovery=True
+    )
+
+
+def load_state(state_path: str) -> Dict:
+    if os.path.exists(state_path):
+        with open(state_path, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(writer: Writer, state_path: str, state: Dict) -> None:
+    writer.write_json(state_path, state)
 
 
 def safe_name(name: str) -> str:
@@ -62,35 +81,50 @@ def csv_to_markdown(csv_bytes: bytes) -> str:
 
 
 def export_file_to_markdown(
-    drive, file_id: str, name: str, mime_type: str
+    drive, file_id: str, name: str, mime_type: str, metrics: Metrics
 ) -> Optional[str]:
     # Google Docs
     if mime_type == "application/vnd.google-apps.document":
         try:
-            data = drive.files().export(fileId=file_id, mimeType="text/html").execute()
-            md = html2text.HTML2Text()
-            md.ignore_images = False
-            md.ignore_links = False
-            return md.handle(data.decode("utf-8", errors="replace"))
+            with metrics.stage("fetch"):
+                data = metrics.call(
+                    "files.export",
+                    drive.files().export(fileId=file_id, mimeType="text/html").execute,
+                )
+            with metrics.stage("convert"):
+                md = html2text.HTML2Text()
+                md.ignore_images = False
+                md.ignore_links = False
+                return md.handle(data.decode("utf-8", errors="replace"))
         except HttpError as e:
             print(f"Export error (Docs) {name}: {e}")
             return None
     # Google Slides
     if mime_type == "application/vnd.google-apps.presentation":
         try:
-            data = drive.files().export(fileId=file_id, mimeType="text/html").execute()
-            md = html2text.HTML2Text()
-            md.ignore_images = False
-            md.ignore_links = False
-            return md.handle(data.decode("utf-8", errors="replace"))
+            with metrics.stage("fetch"):
+                data = metrics.call(
+                    "files.export",
+                    drive.files().export(fileId=file_id, mimeType="text/html").execute,
+                )
+            with metrics.stage("convert"):
+                md = html2text.HTML2Text()
+                md.ignore_images = False
+                md.ignore_links = False
+                return md.handle(data.decode("utf-8", errors="replace"))
         except HttpError as e:
             print(f"Export error (Slides) {name}: {e}")
             return None
     # Google Sheets (first sheet CSV -> MD table)
     if mime_type == "application/vnd.google-apps.spreadsheet":
         try:
-            data = drive.files().export(fileId=file_id, mimeType="text/csv").execute()
-            return csv_to_markdown(data)
+            with metrics.stage("fetch"):
+                data = metrics.call(
+                    "files.export",
+                    drive.files().export(fileId=file_id, mimeType="text/csv").execute,
+                )
+            with metrics.stage("convert"):
+                return csv_to_markdown(data)
         except HttpError as e:
             print(f"Export error (Sheets) {name}: {e}")
             return None
@@ -98,55 +132,106 @@ def export_file_to_markdown(
     return None
 
 
-def save_markdown(name: str, file_id: str, content: str) -> None:
-    ensure_dir("data/md")
+def save_markdown(writer: Writer, name: str, file_id: str, content: str) -> str:
     safe = safe_name(name)
-    path = os.path.join("data", "md", f"{safe}_{file_id}.md")
-    with open(path, "w") as f:
-        f.write(content)
-
-
-def sync() -> None:
-    drive = build_drive_client()
+    path = layout.locate(os.path.join(writer.data_dir, "md"), f"{safe}_{file_id}.md")
+    writer.write_text(path, content)
+    return path
+
+
+def reindex(index: SearchIndex, data_dir: str) -> int:
+    """Index every exported file already in `data_dir`, e.g. after the index was lost.
+
+    File names are `<safe name>_<file id>.md`; an ID that itself contains "_"
+    is cut short here, and the next export replaces that row (rows are keyed
+    by path too). The modified date isn't stored, so a row keeps its old one.
+    """
+    count = 0
+    for path in layout.iter_files(os.path.join(data_dir, "md")):
+        if not path.endswith(".md"):
+            continue
+        name, _, fid = os.path.basename(path)[: -len(".md")].rpartition("_")
+        with open(path, "r", encoding="utf-8") as f:
+            index.upsert("gdrive", fid, name, f.read(), None, path)
+        count += 1
+    return count
+
+
+def sync(drive=None, data_dir: str = "data") -> None:
+    if drive is None:
+        drive = build_drive_client()
     if drive is None:
         return
     q = env("GDRIVE_ROOT_QUERY", "trashed = false")
-
-    page_token = None
+    metrics = Metrics("gdrive")
+    budget = Budget()
+    writer = Writer(data_dir, metrics)
+    index = SearchIndex(index_path(data_dir))
+    state_path = os.path.join(data_dir, "state.json")
+
+    # Continue where a run that hit its time budget stopped: same list page,
+    # skipping the files of that page it had already exported.
+    resume = load_state(state_path).get("resume") or {}
+    if resume.get("query") == q:
+        page_token = resume.get("page_token")
+        skip = resume.get("offset", 0)
+        print("Resuming previous export")
+    else:
+        page_token, skip = None, 0
+    stopped: Optional[Dict] = None
     total = 0
     while True:
         try:
-            resp = (
-                drive.files()
-                .list(
-                    q=q,
-                    fields="nextPageToken, files(id, name, mimeType, modifiedTime)",
-                    pageToken=page_token,
-                    pageSize=200,
+            with metrics.stage("list"):
+                resp = metrics.call(
+                    "files.list",
+                    drive.files()
+                    .list(
+                        q=q,
+                        fields="nextPageToken, files(id, name, mimeType, modifiedTime)",
+                        pageToken=page_token,
+                        pageSize=200,
+                    )
+                    .execute,
                 )
-                .execute()
-            )
         except HttpError as e:
             print(f"List error: {e}")
             break
-        for fmeta in resp.get("files", []):
+        for offset, fmeta in enumerate(resp.get("files", [])):
+            if offset < skip:
+                continue
+            if budget.exhausted():
+                stopped = {"query": q, "page_token": page_token, "offset": offset}
+                break
             fid = fmeta["id"]
             name = fmeta["name"]
             mime = fmeta["mimeType"]
-            md = export_file_to_markdown(drive, fid, name, mime)
+            md = export_file_to_markdown(drive, fid, name, mime, metrics)
             if md is not None:
-                save_markdown(name, fid, md)
+                with metrics.stage("write"):
+                    path = save_markdown(writer, name, fid, md)
+                with metrics.stage("index"):
+                    modified = (fmeta.get("modifiedTime") or "")[:10] or None
+                    index.upsert("gdrive", fid, name, md, modified, path)
                 total += 1
+        if stopped:
+            print("Time budget reached; will resume next run")
+            break
+        skip = 0
         page_token = resp.get("nextPageToken")
         if not page_token:
             break
 
-    ensure_dir("data")
-    with open(os.path.join("data", "state.json"), "w") as f:
-        json.dump(
-            {"last_run": True, "exported": total}, f, ensure_ascii=False, indent=2
-        )
+    index.close()
+    state = {"last_run": True, "exported": total}
+    if stopped:
+        state["resume"] = stopped
+    save_state(writer, state_path, state)
     print(f"Exported {total} file(s) to Markdown")
+    with metrics.stage("chunk"):
+        update_chunks(writer, "gdrive")
+    metrics.emit(writer)
+    writer.save_manifest()
 
 
 if __name__ == "__main__":
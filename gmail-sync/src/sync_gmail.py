@@ -3,15 +3,22 @@ import json
 import os
 import time
 from datetime import datetime, timezone
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from datasync import layout
+from datasync.budget import Budget
+from datasync.chunks import update_chunks
+from datasync.mail import message_text, parse_message
+from datasync.metrics import Metrics
+from datasync.search import SearchIndex, index_path
+from datasync.writer import Writer
 
-def ensure_dir(path: str) -> None:
-    os.makedirs(path, exist_ok=True)
+SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
+SERVICE = ("gmail", "v1")
 
 
 def env(name: str, default: Optional[str] = None) -> Optional[str]:
@@ -33,11 +40,11 @@ def build_gmail_client() -> Optional[any]:
         token_uri="https://oauth2.googleapis.com/token",
         client_id=client_id,
         client_secret=client_secret,
-        scopes=[
-            "https://www.googleapis.com/auth/gmail.readonly",
-        ],
+        scopes=SCOPES,
+    )
+    return build(
+        *SERVICE, credentials=creds, cache_discovery=False, static_discovery=True
     )
-    return build("gmail", "v1", credentials=creds, cache_discovery=False)
 
 
 def load_state(state_path: str) -> Dict:
@@ -47,25 +54,63 @@ def load_state(state_path: str) -> Dict:
     return {}
 
 
-def save_state(state_path: str, state: Dict) -> None:
-    ensure_dir(os.path.dirname(state_path))
-    with open(state_path, "w") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+def save_state(writer: Writer, state_path: str, state: Dict) -> None:
+    writer.write_json(state_path, state)
 
 
-def save_message_eml(message_id: str, raw_b64url: str) -> None:
-    ensure_dir("data/eml")
-    eml_path = os.path.join("data", "eml", f"{message_id}.eml")
+def save_message_eml(writer: Writer, message_id: str, raw_b64url: str) -> str:
+    eml_path = layout.locate(os.path.join(writer.data_dir, "eml"), f"{message_id}.eml")
     raw_bytes = base64.urlsafe_b64decode(raw_b64url.encode("utf-8"))
-    with open(eml_path, "wb") as f:
-        f.write(raw_bytes)
+    writer.write_bytes(eml_path, raw_bytes)
+    return eml_path
 
 
-def save_message_index(message_id: str, meta: Dict) -> None:
-    ensure_dir("data/index")
-    idx_path = os.path.join("data", "index", f"{message_id}.json")
-    with open(idx_path, "w") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
+def save_message_index(writer: Writer, message_id: str, meta: Dict) -> str:
+    idx_path = layout.locate(
+        os.path.join(writer.data_dir, "index"), f"{message_id}.json"
+    )
+    writer.write_json(idx_path, meta)
+    return idx_path
+
+
+def index_message(
+    index: SearchIndex, message_id: str, meta: Dict, raw_bytes: bytes, path: str
+) -> None:
+    headers = {
+        h["name"]: h["value"] for h in meta.get("payload", {}).get("headers", [])
+    }
+    date = None
+    if meta.get("internalDate"):
+        date = datetime.fromtimestamp(
+            int(meta["internalDate"]) / 1000, tz=timezone.utc
+        ).strftime("%Y-%m-%d")
+    body = "\n".join(
+        [
+            f"From: {headers.get('From', '')}",
+            f"To: {headers.get('To', '')}",
+            message_text(parse_message(raw_bytes)) or meta.get("snippet", ""),
+        ]
+    )
+    index.upsert("gmail", message_id, headers.get("Subject", ""), body, date, path)
+
+
+def reindex(index: SearchIndex, data_dir: str) -> int:
+    """Index every message already in `data_dir`, e.g. after the index was lost."""
+    count = 0
+    for idx_path in layout.iter_files(os.path.join(data_dir, "index")):
+        if not idx_path.endswith(".json"):
+            continue
+        mid = os.path.basename(idx_path)[: -len(".json")]
+        eml_path = layout.find(os.path.join(data_dir, "eml"), f"{mid}.eml")
+        if eml_path is None:
+            continue
+        with open(idx_path, "r") as f:
+            meta = json.load(f)
+        with open(eml_path, "rb") as f:
+            raw_bytes = f.read()
+        index_message(index, mid, meta, raw_bytes, idx_path)
+        count += 1
+    return count
 
 
 def choose_query(state: Dict) -> str:
@@ -79,10 +124,19 @@ def choose_query(state: Dict) -> str:
     return "newer_than:90d"
 
 
-def fetch_all_message_ids(gmail, user_id: str, query: str) -> List[str]:
+def fetch_all_message_ids(
+    gmail,
+    user_id: str,
+    query: str,
+    metrics: Metrics,
+    budget: Budget,
+    next_page_token: Optional[str] = None,
+) -> Tuple[List[str], Optional[str]]:
+    """List message IDs; a returned page token means the budget ran out first."""
     ids: List[str] = []
-    next_page_token = None
     while True:
+        if budget.exhausted():
+            return ids, next_page_token
         try:
             req = (
                 gmail.users()
@@ -94,7 +148,7 @@ def fetch_all_message_ids(gmail, user_id: str, query: str) -> List[str]:
                     maxResults=500,
                 )
             )
-            resp = req.execute()
+            resp = metrics.call("messages.list", req.execute)
         except HttpError as e:
             print(f"Error listing messages: {e}")
             break
@@ -107,65 +161,115 @@ def fetch_all_message_ids(gmail, user_id: str, query: str) -> List[str]:
             break
         # be polite
         time.sleep(0.1)
-    return ids
+    return ids, None
 
 
-def sync() -> None:
-    gmail = build_gmail_client()
+def sync(gmail=None, data_dir: str = "data") -> None:
+    if gmail is None:
+        gmail = build_gmail_client()
     if gmail is None:
         return
 
+    metrics = Metrics("gmail")
+    budget = Budget()
+    writer = Writer(data_dir, metrics)
+    index = SearchIndex(index_path(data_dir))
     user_email = env("GMAIL_USER_EMAIL", "me")
-    state_path = os.path.join("data", "state.json")
+    state_path = os.path.join(data_dir, "state.json")
     state = load_state(state_path)
 
     query = choose_query(state)
     print(f"Gmail query: '{query or '(full)'}'")
 
-    message_ids = fetch_all_message_ids(gmail, user_email, query)
+    # A previous run that hit its time budget left its queue and list cursor.
+    resume = state.pop("resume", None)
+    resuming = bool(resume) and resume.get("query") == query
+    if resuming:
+        message_ids = resume.get("pending", [])
+        page_token = resume.get("page_token")
+        print(f"Resuming: {len(message_ids)} queued message(s)")
+    else:
+        message_ids, page_token = [], None
+    if page_token or not resuming:
+        with metrics.stage("list"):
+            listed, page_token = fetch_all_message_ids(
+                gmail, user_email, query, metrics, budget, page_token
+            )
+        message_ids.extend(listed)
     print(f"Found {len(message_ids)} messages")
 
+    def checkpoint(pending: List[str]) -> None:
+        state["resume"] = {
+            "query": query,
+            "page_token": page_token,
+            "pending": pending,
+        }
+        save_state(writer, state_path, state)
+
     fetched = 0
-    for mid in message_ids:
-        eml_path = os.path.join("data", "eml", f"{mid}.eml")
-        if os.path.exists(eml_path):
+    for i, mid in enumerate(message_ids):
+        if budget.exhausted():
+            print(f"Time budget reached; {len(message_ids) - i} message(s) left")
+            checkpoint(message_ids[i:])
+            break
+        if layout.find(os.path.join(data_dir, "eml"), f"{mid}.eml"):
             continue
         try:
-            m = (
-                gmail.users()
-                .messages()
-                .get(
-                    userId=user_email,
-                    id=mid,
-                    format="raw",
+            with metrics.stage("fetch"):
+                m = metrics.call(
+                    "messages.get.raw",
+                    gmail.users()
+                    .messages()
+                    .get(
+                        userId=user_email,
+                        id=mid,
+                        format="raw",
+                    )
+                    .execute,
                 )
-                .execute()
-            )
 
-            save_message_eml(mid, m["raw"])
+            with metrics.stage("write"):
+                save_message_eml(writer, mid, m["raw"])
 
             # also fetch minimal metadata for index
-            meta = (
-                gmail.users()
-                .messages()
-                .get(
-                    userId=user_email,
-                    id=mid,
-                    format="metadata",
-                    metadataHeaders=["From", "To", "Subject", "Date"],
+            with metrics.stage("fetch"):
+                meta = metrics.call(
+                    "messages.get.metadata",
+                    gmail.users()
+                    .messages()
+                    .get(
+                        userId=user_email,
+                        id=mid,
+                        format="metadata",
+                        metadataHeaders=["From", "To", "Subject", "Date"],
+                    )
+                    .execute,
                 )
-                .execute()
-            )
-            save_message_index(mid, meta)
+            with metrics.stage("write"):
+                idx_path = save_message_index(writer, mid, meta)
+            with metrics.stage("index"):
+                raw_bytes = base64.urlsafe_b64decode(m["raw"].encode("utf-8"))
+                index_message(index, mid, meta, raw_bytes, idx_path)
             fetched += 1
         except HttpError as e:
             print(f"Error fetching {mid}: {e}")
         # throttle a bit to reduce API pressure
         time.sleep(0.05)
-
+    else:
+        if page_token:
+            # listing was cut short; continue it next run
+            checkpoint([])
+        else:
+            state.pop("resume", None)
+
+    index.close()
     state["last_run"] = datetime.now(timezone.utc).isoformat()
-    save_state(state_path, state)
+    save_state(writer, state_path, state)
     print(f"Fetched {fetched} new messages")
+    with metrics.stage("chunk"):
+        update_chunks(writer, "gmail")
+    metrics.emit(writer)
+    writer.save_manifest()
 
 
 if __name__ == "__main__":
@@ -1,14 +1,17 @@
 import os
 import json
-from notion_client import Client
+from notion_client import APIResponseError, Client
 from typing import Dict, Any
 from dotenv import load_dotenv
 
-load_dotenv()
-
+from datasync import layout
+from datasync.budget import Budget
+from datasync.chunks import update_chunks
+from datasync.metrics import Metrics
+from datasync.search import SearchIndex, index_path
+from datasync.writer import Writer
 
-def ensure_dir(path: str) -> None:
-    os.makedirs(path, exist_ok=True)
+load_dotenv()
 
 
 def env(name: str, default: str = None) -> str:
@@ -16,18 +19,17 @@ def env(name: str, default: str = None) -> str:
     return val if val is not None and val != "" else default
 
 
-def save_json(path: str, data: Any) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def save_json(writer: Writer, path: str, data: Any) -> None:
+    writer.write_json(path, data)
 
 
-def save_markdown(path: str, title: str, properties: Dict, url: str) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(f"# {title}\n\n")
-        f.write(f"URL: {url}\n\n")
-        f.write("## Properties\n\n")
-        for key, value in properties.items():
-            f.write(f"- **{key}**: {value}\n")
+def save_markdown(
+    writer: Writer, path: str, title: str, properties: Dict, url: str
+) -> None:
+    lines = [f"# {title}\n\n", f"URL: {url}\n\n", "## Properties\n\n"]
+    for key, value in properties.items():
+        lines.append(f"- **{key}**: {value}\n")
+    writer.write_text(path, "".join(lines))
 
 
 def get_title(page: Dict) -> str:
@@ -40,31 +42,101 @@ def get_title(page: Dict) -> str:
     return "Untitled"
 
 
-def sync():
+def property_text(value: Dict) -> str:
+    """Readable text of a page property: rich text, titles, names and plain values."""
+    data = value.get(value.get("type") or "")
+    if isinstance(data, str):  # url, email, phone_number
+        return data
+    if isinstance(data, dict):  # select, status
+        return data.get("name") or ""
+    if isinstance(data, list):  # title, rich_text, multi_select
+        return " ".join(
+            item.get("plain_text") or item.get("name") or ""
+            for item in data
+            if isinstance(item, dict)
+        ).strip()
+    return ""
+
+
+def index_page(index: SearchIndex, page: Dict, title: str, path: str) -> None:
+    properties = page.get("properties", {})
+    texts = ((key, property_text(val)) for key, val in properties.items())
+    body = "\n".join(f"{key}: {text}" for key, text in texts if text)
+    edited = (page.get("last_edited_time") or "")[:10] or None
+    index.upsert("notion", page.get("id"), title, body, edited, path)
+
+
+def reindex(index: SearchIndex, data_dir: str) -> int:
+    """Index every page already in `data_dir`, e.g. after the index was lost."""
+    count = 0
+    for json_path in layout.iter_files(os.path.join(data_dir, "pages")):
+        if not json_path.endswith(".json"):
+            continue
+        with open(json_path, "r", encoding="utf-8") as f:
+            page = json.load(f)
+        if page.get("object") == "page":
+            md_path = json_path[: -len(".json")] + ".md"
+            index_page(index, page, get_title(page), md_path)
+            count += 1
+    return count
+
+
+def build_notion_client() -> Client:
     notion_token = env("NOTION_API_KEY")
     if not notion_token:
         print("Notion: NOTION_API_KEY not found, skipping.")
-        return
+        return None
+    return Client(auth=notion_token)
+
 
-    client = Client(auth=notion_token)
+def sync(client: Client = None, data_dir: str = "data"):
+    if client is None:
+        client = build_notion_client()
+    if client is None:
+        return
 
+    metrics = Metrics("notion")
+    budget = Budget()
+    writer = Writer(data_dir, metrics)
+    index = SearchIndex(index_path(data_dir))
     print("Notion: Searching for pages...")
     # Search for all pages and databases
     results = []
     has_more = True
+    # Continue the search cursor of a run that hit its time budget.
+    state_path = os.path.join(data_dir, "state.json")
     start_cursor = None
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            start_cursor = json.load(f).get("start_cursor")
+    resumed = bool(start_cursor)
+    if resumed:
+        print("Notion: Resuming previous search")
 
     while has_more:
-        response = client.search(start_cursor=start_cursor)
+        if budget.exhausted():
+            print("Notion: Time budget reached; will resume next run")
+            break
+        try:
+            with metrics.stage("list"):
+                response = metrics.call(
+                    "search", client.search, start_cursor=start_cursor
+                )
+        except APIResponseError as e:
+            if not resumed:
+                raise
+            # a saved cursor the API rejects would fail every later run too
+            print(f"Notion: Saved search cursor rejected ({e}); starting over")
+            start_cursor = None
+            resumed = False
+            continue
+        resumed = False
         results.extend(response.get("results", []))
         has_more = response.get("has_more", False)
         start_cursor = response.get("next_cursor")
 
     print(f"Notion: Found {len(results)} items.")
 
-    ensure_dir(os.path.join("data", "pages"))
-    ensure_dir(os.path.join("data", "databases"))
-
     for item in results:
         obj_type = item.get("object")
         item_id = item.get("id")
@@ -82,18 +154,19 @@ def sync():
             filename = f"{safe_title}_{item_id}.json"
             md_filename = f"{safe_title}_{item_id}.md"
 
-            # Save raw JSON
-            save_json(os.path.join("data", "pages", filename), item)
-
-            # Save simple Markdown
-            # Note: This doesn't fetch page content (blocks), just properties for now to keep it simple and fast.
-            # Fetching blocks would require recursive calls.
-            save_markdown(
-                os.path.join("data", "pages", md_filename),
-                title,
-                item.get("properties", {}),
-                url,
-            )
+            with metrics.stage("write"):
+                # Save raw JSON
+                json_path = layout.locate(os.path.join(data_dir, "pages"), filename)
+                save_json(writer, json_path, item)
+
+                # Save simple Markdown
+                # Note: This doesn't fetch page content (blocks), just properties for now to keep it simple and fast.
+                # Fetching blocks would require recursive calls.
+                md_path = layout.locate(os.path.join(data_dir, "pages"), md_filename)
+                save_markdown(writer, md_path, title, item.get("properties", {}), url)
+
+            with metrics.stage("index"):
+                index_page(index, item, title, md_path)
 
         elif obj_type == "database":
             title_list = item.get("title", [])
@@ -109,9 +182,17 @@ def sync():
                 safe_title = item_id
 
             filename = f"{safe_title}_{item_id}.json"
-            save_json(os.path.join("data", "databases", filename), item)
+            json_path = os.path.join(data_dir, "databases", filename)
+            with metrics.stage("write"):
+                save_json(writer, json_path, item)
 
+    index.close()
+    save_json(writer, state_path, {"start_cursor": start_cursor if has_more else None})
     print("Notion: Sync complete.")
+    with metrics.stage("chunk"):
+        update_chunks(writer, "notion")
+    metrics.emit(writer)
+    writer.save_manifest()
 
 
 if __name__ == "__main__":
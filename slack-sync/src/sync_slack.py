@@ -1,14 +1,18 @@
+import hashlib
 import json
 import os
-from datetime import datetime, timezone
-from typing import Dict, Optional, List
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, List, Tuple
 
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
-
-def ensure_dir(path: str) -> None:
-    os.makedirs(path, exist_ok=True)
+from datasync import layout
+from datasync.budget import Budget
+from datasync.chunks import update_chunks
+from datasync.metrics import Metrics
+from datasync.search import SearchIndex, index_path
+from datasync.writer import Writer
 
 
 def env(name: str, default: Optional[str] = None) -> Optional[str]:
@@ -16,26 +20,26 @@ def env(name: str, default: Optional[str] = None) -> Optional[str]:
     return val if val is not None and val != "" else default
 
 
-def load_state() -> Dict:
-    path = os.path.join("data", "state.json")
+def load_state(data_dir: str) -> Dict:
+    path = os.path.join(data_dir, "state.json")
     if os.path.exists(path):
         with open(path, "r") as f:
             return json.load(f)
     return {}
 
 
-def save_state(state: Dict) -> None:
-    ensure_dir("data")
-    with open(os.path.join("data", "state.json"), "w") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+def save_state(writer: Writer, state: Dict) -> None:
+    writer.write_json(os.path.join(writer.data_dir, "state.json"), state)
 
 
-def iter_channels(client: WebClient) -> List[Dict]:
+def iter_channels(client: WebClient, metrics: Metrics) -> List[Dict]:
     channels: List[Dict] = []
     cursor = None
     while True:
         try:
-            resp = client.conversations_list(
+            resp = metrics.call(
+                "conversations.list",
+                client.conversations_list,
                 limit=1000,
                 cursor=cursor,
                 types="public_channel,private_channel",
@@ -50,57 +54,271 @@ def iter_channels(client: WebClient) -> List[Dict]:
     return channels
 
 
-def write_jsonl(channel_name: str, ts: float, message: Dict) -> None:
-    dt = datetime.fromtimestamp(ts, tz=timezone.utc)
-    ensure_dir(os.path.join("data", "slack", channel_name))
-    path = os.path.join("data", "slack", channel_name, dt.strftime("%Y-%m-%d") + ".jsonl")
-    with open(path, "a") as f:
-        f.write(json.dumps(message, ensure_ascii=False) + "\n")
+def day_of(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def day_path(data_dir: str, channel_name: str, day: str) -> str:
+    return layout.locate(os.path.join(data_dir, "slack", channel_name), day + ".jsonl")
+
+
+def append_jsonl(writer: Writer, path: str, messages: List[Dict]) -> None:
+    # One append per day file per page: each append rewrites the file. A crawl
+    # restarted without its cursor sees messages again; keep one copy of each.
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            have = {json.loads(line).get("ts") for line in f if line.strip()}
+        messages = [m for m in messages if m.get("ts") not in have]
+    if not messages:
+        return
+    lines = "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in messages)
+    writer.append_text(path, lines)
+
+
+def write_day(writer: Writer, path: str, messages: List[Dict]) -> bool:
+    messages = sorted(messages, key=lambda m: float(m["ts"]))
+    return writer.write_text(
+        path, "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in messages)
+    )
+
+
+def fingerprint(message: Dict) -> str:
+    """What changes when a message is edited, deleted, replied to or reacted to."""
+    reactions = ",".join(
+        f"{r.get('name')}:{r.get('count', 0)}" for r in message.get("reactions", [])
+    )
+    return "|".join(
+        [
+            message.get("ts", ""),
+            (message.get("edited") or {}).get("ts", ""),
+            str(message.get("reply_count", 0)),
+            message.get("subtype", ""),  # "tombstone" for deleted thread parents
+            reactions,
+        ]
+    )
+
+
+def day_digest(messages: List[Dict]) -> str:
+    h = hashlib.sha1()
+    for fp in sorted(fingerprint(m) for m in messages):
+        h.update(fp.encode("utf-8") + b"\n")
+    return h.hexdigest()[:16]
 
 
-def sync() -> None:
+def reconcile_channel(
+    writer: Writer,
+    index: SearchIndex,
+    data_dir: str,
+    channel_name: str,
+    by_day: Dict[str, List[Dict]],
+    digests: Dict[str, str],
+    days: List[str],
+) -> Tuple[Dict[str, str], List[str]]:
+    """Rewrite the day files whose digest changed; return new digests and paths."""
+    new_digests: Dict[str, str] = {}
+    touched = []
+    for day in sorted(set(days) | set(by_day)):
+        messages = by_day.get(day, [])
+        digest = day_digest(messages) if messages else None
+        if digest is not None:
+            new_digests[day] = digest
+            if digest == digests.get(day):
+                continue
+        path = day_path(data_dir, channel_name, day)
+        if messages:
+            if write_day(writer, path, messages):
+                touched.append(path)
+        elif writer.delete(path):
+            # every message of that day was deleted
+            index.delete("slack", f"{channel_name}/{day}")
+    return new_digests, touched
+
+
+def index_day_file(index: SearchIndex, channel_name: str, path: str) -> None:
+    day = os.path.basename(path)[: -len(".jsonl")]
+    lines = []
+    with open(path, "r") as f:
+        for raw in f:
+            try:
+                m = json.loads(raw)
+            except ValueError:
+                continue
+            author = m.get("user") or m.get("username") or ""
+            lines.append(f"{author}: {m.get('text', '')}")
+    index.upsert(
+        "slack",
+        f"{channel_name}/{day}",
+        f"#{channel_name} {day}",
+        "\n".join(lines),
+        day,
+        path,
+    )
+
+
+def reindex(index: SearchIndex, data_dir: str) -> int:
+    """Index every day file already in `data_dir`, e.g. after the index was lost."""
+    count = 0
+    slack_dir = os.path.join(data_dir, "slack")
+    if not os.path.isdir(slack_dir):
+        return 0
+    for channel_name in sorted(os.listdir(slack_dir)):
+        for path in layout.iter_files(os.path.join(slack_dir, channel_name)):
+            if path.endswith(".jsonl"):
+                index_day_file(index, channel_name, path)
+                count += 1
+    return count
+
+
+def build_slack_client() -> Optional[WebClient]:
     token = env("SLACK_BOT_TOKEN")
     if not token:
         print("Slack: missing token, skipping.")
+        return None
+    return WebClient(token=token)
+
+
+def sync(client: Optional[WebClient] = None, data_dir: str = "data") -> None:
+    if client is None:
+        client = build_slack_client()
+    if client is None:
         return
-    client = WebClient(token=token)
-    state = load_state()
+    metrics = Metrics("slack")
+    budget = Budget()
+    writer = Writer(data_dir, metrics)
+    index = SearchIndex(index_path(data_dir))
+    state = load_state(data_dir)
     ch_state = state.setdefault("channels", {})
 
-    channels = iter_channels(client)
+    # Edits, deletions and reactions only show up by re-reading history, so
+    # channels active within the last SLACK_RECONCILE_DAYS days are read from
+    # the start of that window (UTC midnight) instead of from `last_ts`.
+    lookback = int(env("SLACK_RECONCILE_DAYS", "7"))
+    window: Optional[datetime] = None
+    window_days: List[str] = []
+    if lookback > 0:
+        today = datetime.now(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        window = today - timedelta(days=lookback)
+        window_days = [
+            (window + timedelta(days=i)).strftime("%Y-%m-%d")
+            for i in range(lookback + 1)
+        ]
+
+    with metrics.stage("list"):
+        channels = iter_channels(client, metrics)
     print(f"Found {len(channels)} channels")
 
+    stopped = False
     for ch in channels:
         cid = ch["id"]
         name = ch.get("name") or cid
-        last_ts = ch_state.get(cid, {}).get("last_ts")
-        cursor = None
+        entry = ch_state.get(cid, {})
+        # `last_ts` only advances once a channel's pagination completes; an
+        # interrupted crawl keeps its cursor and newest ts seen so far instead.
+        last_ts = entry.get("last_ts")
+        cursor = entry.get("cursor")
+        newest = entry.get("pending_ts") or last_ts
+        reconcile = bool(
+            window is not None
+            and last_ts
+            and not cursor
+            and float(last_ts) >= window.timestamp()
+        )
+        oldest = str(window.timestamp()) if reconcile else last_ts or "0"
+        window_messages: Dict[str, List[Dict]] = {}
+        complete = False
         fetched = 0
+        touched = set()
         while True:
+            if budget.exhausted():
+                stopped = True
+                break
             try:
-                resp = client.conversations_history(
-                    channel=cid, limit=1000, cursor=cursor, oldest=last_ts or "0"
-                )
+                with metrics.stage("fetch"):
+                    resp = metrics.call(
+                        "conversations.history",
+                        client.conversations_history,
+                        channel=cid,
+                        limit=1000,
+                        cursor=cursor,
+                        oldest=oldest,
+                        inclusive=reconcile,  # keep messages sent at midnight
+                    )
             except SlackApiError as e:
                 print(f"History error {name}: {e}")
+                if cursor and e.response.get("error") == "invalid_cursor":
+                    # an expired cursor fails the same way on every run:
+                    # crawl again from last_ts next time
+                    cursor = None
+                    newest = last_ts
                 break
-            messages = resp.get("messages", [])
-            for m in messages:
+            by_day: Dict[str, List[Dict]] = {}
+            for m in resp.get("messages", []):
                 try:
                     ts = float(m["ts"])
                 except Exception:
                     continue
-                write_jsonl(name, ts, m)
-                fetched += 1
+                by_day.setdefault(day_of(ts), []).append(m)
                 if not last_ts or ts > float(last_ts):
-                    last_ts = str(ts)
+                    fetched += 1
+                if not newest or ts > float(newest):
+                    newest = str(ts)
+            if reconcile:
+                # day files are rewritten from the whole window once it's read
+                for day, day_messages in by_day.items():
+                    window_messages.setdefault(day, []).extend(day_messages)
+            else:
+                with metrics.stage("write"):
+                    for day, day_messages in by_day.items():
+                        path = day_path(data_dir, name, day)
+                        append_jsonl(writer, path, day_messages)
+                        touched.add(path)
             cursor = resp.get("response_metadata", {}).get("next_cursor")
             if not cursor:
+                complete = True
                 break
-        ch_state[cid] = {"name": name, "last_ts": last_ts}
-        print(f"{name}: +{fetched}")
-    save_state(state)
+        digests = {
+            day: digest
+            for day, digest in entry.get("days", {}).items()
+            if window_days and day >= window_days[0]
+        }
+        if reconcile and complete:
+            with metrics.stage("reconcile"):
+                digests, rewritten = reconcile_channel(
+                    writer, index, data_dir, name, window_messages, digests, window_days
+                )
+            touched.update(rewritten)
+        with metrics.stage("index"):
+            for path in sorted(touched):
+                index_day_file(index, name, path)
+        if reconcile and not complete:
+            # nothing of a partial window crawl was written; re-read it next run
+            ch_state[cid] = entry
+        elif not complete:
+            # stopped by the budget or an API error: continue from `cursor`
+            ch_state[cid] = {
+                "name": name,
+                "last_ts": last_ts,
+                "cursor": cursor,
+                "pending_ts": newest,
+            }
+        else:
+            ch_state[cid] = {"name": name, "last_ts": newest}
+        if digests:
+            ch_state[cid]["days"] = digests
+        rewritten_note = f", {len(touched)} day file(s) rewritten" if reconcile else ""
+        print(f"{name}: +{fetched}{rewritten_note}")
+        if stopped:
+            print("Time budget reached; remaining channels continue next run")
+            break
+    index.close()
+    save_state(writer, state)
     print("Slack sync done.")
+    with metrics.stage("chunk"):
+        update_chunks(writer, "slack")
+    metrics.emit(writer)
+    writer.save_manifest()
 
 
 if __name__ == "__main__":